@@ -1,13 +1,98 @@
+import contextlib
+import io
 import os
+import queue
+import threading
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
+from read import getImage, readData, toAlnum
+from stats import Stats
+from write import OUTPUT_FORMATS, writeFile
 
 # Create main application window
 root = tk.Tk()
 root.title("Steganography Tool")
-root.geometry("450x450")
+root.geometry("450x520")
 root.resizable(False, False)
 
+# Delay between two checks of the running job, in ms
+POLL_DELAY = 50
+
+# Events sent by the running job to the window, and request to cancel it
+job_events = queue.Queue()
+job_cancel = threading.Event()
+
+class Cancelled(Exception):
+    """Raised in the running job to stop it between two chunks."""
+
+# Function to report the progress of the running job, called by its chunks
+def report_progress(done, total):
+    if job_cancel.is_set():
+        raise Cancelled()
+    job_events.put(("progress", done / total if total else 1))
+
+# Function to run a job in the background, its output being kept to report errors
+def run_job(job):
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            job_events.put(("done", job(report_progress)))
+    except Cancelled:
+        job_events.put(("cancelled", None))
+    except SystemExit:
+        lines = log.getvalue().strip().splitlines()
+        job_events.put(("error", lines[-1] if lines else "The operation was aborted."))
+    except Exception as e:
+        job_events.put(("error", str(e)))
+
+# Function to start a job on a worker thread, so that the window stays responsive
+def start_job(job, on_done):
+    job_cancel.clear()
+    for button in (write_button, read_button):
+        button.config(state="disabled")
+    cancel_button.config(state="normal")
+    status_label.config(text="Working...")
+    progress_bar.config(mode="indeterminate")
+    progress_bar.start(10)
+
+    threading.Thread(target=run_job, args=(job,), daemon=True).start()
+    root.after(POLL_DELAY, poll_job, on_done)
+
+# Function to apply the events of the running job, polled by the main loop
+def poll_job(on_done):
+    while True:
+        try:
+            kind, value = job_events.get_nowait()
+        except queue.Empty:
+            root.after(POLL_DELAY, poll_job, on_done)
+            return
+
+        if kind == "progress":
+            progress_bar.stop()
+            progress_bar.config(mode="determinate", value=100 * value)
+            continue
+
+        # The job is over
+        progress_bar.stop()
+        progress_bar.config(mode="determinate", value=100 if kind == "done" else 0)
+        for button in (write_button, read_button):
+            button.config(state="normal")
+        cancel_button.config(state="disabled")
+
+        if kind == "done":
+            on_done(value)
+        elif kind == "cancelled":
+            status_label.config(text="Cancelled.")
+        else:
+            status_label.config(text="Failed.")
+            messagebox.showerror("Error", value)
+        return
+
+# Function to describe the time spent in every stage of a job
+def describe_stats(record):
+    stages = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in record["stages"].items())
+    return f"Done in {record['total_seconds']:.2f}s ({stages})."
+
 # Function for file selection
 def select_file(entry):
     file_path = filedialog.askopenfilename(filetypes=[("Image Files", "*.png;*.jpg;*.jpeg")])
@@ -15,9 +100,9 @@ def select_file(entry):
         entry.delete(0, tk.END)
         entry.insert(0, file_path)
 
-# Function to execute the write program
+# Function to execute the write program in the background
 def write_steganography():
-    input_file = "\"" + write_input_entry.get().strip() + "\""
+    input_file = write_input_entry.get().strip()
     output_file = os.path.join(os.path.expanduser("~/Desktop"), write_output_entry.get().strip())
     lsb_value = write_lsb_spinbox.get()
     use_gray = write_gray_var.get()
@@ -29,25 +114,27 @@ def write_steganography():
         messagebox.showerror("Error", "Please provide input and output file names.")
         return
 
-    # Write user text to a file
-    textFile = "./tempText.txt"
-    with open(textFile, "w") as file:
-        file.write(write_text_textbox.get("1.0", tk.END))
-
-    command = f"python ./write.py {input_file} {output_file} -n {lsb_value} -fromfile {textFile}"
-    if use_gray:
-        command += " -gray"
-    if no_red:
-        command += " -nored"
-    if no_green:
-        command += " -nogreen"
-    if no_blue:
-        command += " -noblue"
-
-    os.system(command)
-    messagebox.showinfo("Success", "Steganography writing completed!")
-
-# Function to execute the read program
+    # Lossy formats would destroy the message
+    if not output_file.lower().endswith(OUTPUT_FORMATS):
+        messagebox.showerror("Error", "Please use a .png, .tiff or .bmp modified image name.")
+        return
+
+    # The user text is written as bytes, as files given to the writer
+    message = write_text_textbox.get("1.0", tk.END).encode()
+
+    def job(progress):
+        stats = {}
+        writeFile(input_file, output_file, message, int(lsb_value), no_red, no_green, no_blue, use_gray,
+                  stats=stats, progress=progress)
+        return stats
+
+    def on_done(stats):
+        status_label.config(text=describe_stats(stats))
+        messagebox.showinfo("Success", "Steganography writing completed!")
+
+    start_job(job, on_done)
+
+# Function to execute the read program in the background
 def read_steganography():
     input_file = read_input_entry.get().strip()
     lsb_value = read_lsb_spinbox.get()
@@ -60,27 +147,23 @@ def read_steganography():
         messagebox.showerror("Error", "Please provide an input file.")
         return
 
-    output_file = os.path.join(os.path.dirname(input_file), "textOutput.txt")
-    command = f'python ./read.py "{input_file}" "{output_file}" -n {lsb_value}'
-    if max_chars:
-        command += f" -l {max_chars}"
-    if no_red:
-        command += " -nored"
-    if no_green:
-        command += " -nogreen"
-    if no_blue:
-        command += " -noblue"
-
-    os.system(command)
-
-    if os.path.exists(output_file):
-        with open(output_file, "r") as f:
-            text = "".join([ch for ch in f.read() if ch.isalnum])
-            read_output_textbox.delete("1.0", tk.END)
-            read_output_textbox.insert(tk.END, text)
+    def job(progress):
+        timer = Stats()
+        with timer.stage("decode"):
+            img, gray = getImage(input_file)
+        with timer.stage("extract"):
+            data, binary = readData(img, max_chars, int(lsb_value), no_red, no_green, no_blue,
+                                    progress=progress)
+        return data.decode(errors="replace") if binary else toAlnum(data), timer.record()
+
+    def on_done(result):
+        text, record = result
+        read_output_textbox.delete("1.0", tk.END)
+        read_output_textbox.insert(tk.END, text)
+        status_label.config(text=describe_stats(record))
         messagebox.showinfo("Success", "Data read successfully!")
-    else:
-        messagebox.showerror("Error", "No output file generated. Check your input.")
+
+    start_job(job, on_done)
 
 # Function to copy output text to clipboard
 def copy_to_clipboard():
@@ -110,7 +193,7 @@ write_output_label.pack(pady=5)
 write_output_entry = ttk.Entry(write_tab, width=50)
 write_output_entry.pack(pady=5)
 
-write_text_label = ttk.Label(write_tab, text="Text to write (ASCII only):")
+write_text_label = ttk.Label(write_tab, text="Text to write:")
 write_text_label.pack(pady=5)
 write_text_textbox = tk.Text(write_tab, height=5, width=50, state="normal")
 write_text_textbox.pack(pady=5)
@@ -135,7 +218,8 @@ ttk.Checkbutton(write_check_frame, text="Use Red", variable=write_red_var).pack(
 ttk.Checkbutton(write_check_frame, text="Use Green", variable=write_green_var).pack(side='left', pady=5, padx=5)
 ttk.Checkbutton(write_check_frame, text="Use Blue", variable=write_blue_var).pack(side='left', pady=5, padx=5)
 
-ttk.Button(write_tab, text="Execute", command=write_steganography).pack(pady=10)
+write_button = ttk.Button(write_tab, text="Execute", command=write_steganography)
+write_button.pack(pady=10)
 
 # Tab 2: Read
 read_tab = ttk.Frame(notebook)
@@ -178,9 +262,20 @@ read_output_textbox.pack(pady=5)
 
 read_buttons_frame = ttk.Frame(read_tab)
 read_buttons_frame.pack(pady=5)
-ttk.Button(read_buttons_frame, text="Execute", command=read_steganography).pack(anchor='w', side='left', padx=5)
+read_button = ttk.Button(read_buttons_frame, text="Execute", command=read_steganography)
+read_button.pack(anchor='w', side='left', padx=5)
 ttk.Button(read_buttons_frame, text="Copy to Clipboard", command=lambda: copy_to_clipboard()).pack(anchor='e',side='left', padx=5)
 
+# Progress of the running job, shared by both tabs
+job_frame = ttk.Frame(root)
+job_frame.pack(side='bottom', fill='x', padx=10, pady=5)
+progress_bar = ttk.Progressbar(job_frame, mode="determinate", maximum=100)
+progress_bar.pack(side='left', expand=True, fill='x', padx=5)
+cancel_button = ttk.Button(job_frame, text="Cancel", command=job_cancel.set, state="disabled")
+cancel_button.pack(side='left', padx=5)
+status_label = ttk.Label(root, text="Ready.")
+status_label.pack(side='bottom', fill='x', padx=15)
+
 notebook.pack(expand=True, fill="both")
 
 root.mainloop()
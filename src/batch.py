@@ -0,0 +1,256 @@
+import contextlib
+import csv
+import glob
+import io
+import json
+import os
+import sys
+import time
+from cache import getCache, setCache
+from stats import aggregate, saveStats
+from read import readFile
+from samples import runPool
+from write import writeFile
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Steganography batch tool.
+"""
+
+def printDoc():
+    """Displays the documentation of the script and exits"""
+
+    print("""[steganographyBatch.py]
+Hides or reads text in many images with a pool of processes.
+
+The images are either listed in a manifest (.csv with a header row, or .jsonl
+with one object per line) or matched by a glob pattern. Manifest columns:
+    input, output: The image and the output file of each operation.
+    payload: A file holding the message to write, as bytes.
+    message: The message to write, used instead of payload.
+    n, nored, nogreen, noblue, gray, raw, l, tile, compress, level, key, fec,
+        pnglevel, tiffcompression, keepmeta: Per image flags, which override
+        the flags given on the command line.
+
+Flags:
+    -h: Displays this message and exits.
+    -glob: Processes the images matching a pattern instead of a manifest.
+    -outdir: The folder the outputs of -glob are saved to.
+    -fromfile: The file to write, for rows without payload or message.
+    -j: The number of worker processes (number of CPUs by default).
+    -chunk: The number of images sent to a worker at once.
+    -report: Saves the status of every image to a .jsonl file.
+    -stats: Prints the time spent in every stage, summed over the images, as
+            a JSON line (-stats json), or saves it to a .json file.
+    -cache: The memory budget in MB of the decoded images kept by every
+            worker, so that consecutive rows reading the same image decode
+            it once (0 by default).
+    -gray, -nored, -nogreen, -noblue, -n, -raw, -l, -tile, -compress,
+        -level, -key, -fec, -pnglevel, -tiffcompression, -keepmeta: Same as
+        the write.py and read.py flags, applied to every image.
+
+Example:
+    python ./batch.py write <manifest.csv> | -flags
+    python ./batch.py read -glob "<images/*.png>" -outdir <texts> | -flags
+""")
+    exit(0)
+
+def toFlag(value):
+    """Converts a manifest value to a boolean."""
+
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes", "y")
+    return bool(value)
+
+def getManifest(filePath):
+    """Reads the rows of a .csv or .jsonl manifest."""
+
+    with open(filePath, newline="") as file:
+        if filePath.endswith(".jsonl"):
+            return [json.loads(line) for line in file if line.strip()]
+        return list(csv.DictReader(file))
+
+def getItems(mode, rows, options):
+    """Merges the options of every manifest row with the command line ones."""
+
+    items = []
+    for row in rows:
+        item = dict(options, mode=mode)
+        item.update({key: value for key, value in row.items() if value not in (None, "")})
+
+        # Normalize the types of values read from text manifests
+        for key in ("gray", "nored", "nogreen", "noblue", "raw", "fec", "keepmeta"):
+            item[key] = toFlag(item[key])
+        for key in ("n", "l", "tile", "level", "pnglevel"):
+            if key in item:
+                item[key] = int(item[key])
+
+        items.append(item)
+
+    return items
+
+def runItem(item):
+    """Runs one writing or reading operation, returns its status."""
+
+    start = time.perf_counter()
+    status = {"input": item["input"], "output": item["output"]}
+
+    # Keep the output of the tools to report errors
+    log = io.StringIO()
+    try:
+        with contextlib.redirect_stdout(log):
+            if item["mode"] == "write":
+                message = item.get("message")
+                if message is None:
+                    message = open(item["payload"], 'rb').read()
+                stats = {}
+                chars = writeFile(item["input"], item["output"], message, item["n"],
+                                  item["nored"], item["nogreen"], item["noblue"],
+                                  item["gray"], not item["raw"], item["tile"],
+                                  item.get("compress"), item.get("level"), key = item.get("key"),
+                                  correction = item["fec"], pngLevel = item.get("pnglevel"),
+                                  tiffCompression = item.get("tiffcompression"),
+                                  keepMeta = item["keepmeta"], stats = stats)
+                status.update(stats)
+                status["status"] = "ok" if chars == len(message) else "truncated"
+            else:
+                stats = {}
+                chars = len(readFile(item["input"], item["output"], item["l"], item["n"],
+                                     item["nored"], item["nogreen"], item["noblue"],
+                                     item["tile"], cache = getCache(), key = item.get("key"),
+                                     stats = stats))
+                status.update(stats)
+                status["status"] = "ok"
+            status["chars"] = chars
+    except SystemExit:
+        lines = log.getvalue().strip().splitlines()
+        status.update(status="error", error=lines[-1] if lines else "The operation was aborted.")
+    except Exception as e:
+        status.update(status="error", error=str(e))
+
+    status["seconds"] = time.perf_counter() - start
+    status["bytes"] = os.path.getsize(item["input"]) if os.path.exists(item["input"]) else 0
+
+    return status
+
+def runBatch(items, workers = None, chunk = 0, budget = 0):
+    """Runs operations on a pool of processes, yields their status in order.
+
+    Every process caches budget bytes of decoded images.
+    """
+
+    yield from runPool(runItem, items, workers, chunk, setCache, (budget,))
+
+if __name__ == "__main__":
+    print("")
+
+    # Get arguments
+    args = sys.argv[1:]
+
+    # Show the documentation if needed
+    if "-h" in args or len(args) < 2 or args[0] not in ("write", "read"):
+        printDoc()
+    mode = args[0]
+
+    # Options applied to every image
+    options = {"gray": False, "nored": False, "nogreen": False, "noblue": False,
+               "raw": False, "fec": False, "keepmeta": False, "n": 1, "l": 0, "tile": 0}
+    workers, chunk, report, payload, budget = None, 0, None, None, 0
+    statsTarget = None
+
+    # Update flags
+    for flag in ("-gray", "-nored", "-nogreen", "-noblue", "-raw", "-fec", "-keepmeta"):
+        if flag in args:
+            options[flag[1:]] = True
+    try:
+        for flag in ("-n", "-l", "-tile", "-pnglevel"):
+            if flag in args:
+                options[flag[1:]] = int(args[args.index(flag) + 1])
+        if "-j" in args:
+            workers = int(args[args.index("-j") + 1])
+        if "-chunk" in args:
+            chunk = int(args[args.index("-chunk") + 1])
+        if "-cache" in args:
+            budget = int(args[args.index("-cache") + 1]) * 1e6
+    except (IndexError, ValueError):
+        print("The -n, -l, -tile, -pnglevel, -j, -chunk and -cache flags need to be followed by an integer value.\n")
+        exit(1)
+    try:
+        if "-report" in args:
+            report = args[args.index("-report") + 1]
+        if "-fromfile" in args:
+            payload = args[args.index("-fromfile") + 1]
+            options["payload"] = payload
+        if "-compress" in args:
+            options["compress"] = args[args.index("-compress") + 1]
+        if "-level" in args:
+            options["level"] = args[args.index("-level") + 1]
+        if "-key" in args:
+            options["key"] = args[args.index("-key") + 1]
+        if "-tiffcompression" in args:
+            options["tiffcompression"] = args[args.index("-tiffcompression") + 1]
+        if "-stats" in args:
+            statsTarget = args[args.index("-stats") + 1]
+    except IndexError:
+        print("The -report, -fromfile, -compress, -level, -key, -tiffcompression and -stats flags need to be followed by a value.\n")
+        exit(1)
+
+    # Get the images to process
+    if "-glob" in args:
+        try:
+            pattern = args[args.index("-glob") + 1]
+            outdir = args[args.index("-outdir") + 1]
+        except (IndexError, ValueError):
+            print("The -glob flag needs to be followed by a pattern, and used with -outdir <folder>.\n")
+            exit(1)
+        os.makedirs(outdir, exist_ok=True)
+        extension = ".png" if mode == "write" else ".txt"
+        rows = [{"input": path,
+                 "output": os.path.join(outdir, os.path.splitext(os.path.basename(path))[0] + extension)}
+                for path in sorted(glob.glob(pattern))]
+    else:
+        try:
+            rows = getManifest(args[1])
+        except (OSError, ValueError) as e:
+            print(f"The manifest could not be read ({e}). Exiting...")
+            exit(1)
+    items = getItems(mode, rows, options)
+
+    if mode == "write" and any("payload" not in item and "message" not in item for item in items):
+        print("Every image needs a message: use -fromfile, or the payload or message columns.\n")
+        exit(1)
+
+    # User information
+    print(f"{len(items)} images will be processed by {workers or os.cpu_count()} processes.")
+
+    # Process the images
+    start = time.perf_counter()
+    statuses = []
+    for status in runBatch(items, workers, chunk, budget):
+        statuses.append(status)
+        print(f"[{status['status']}] {status['input']} -> {status['output']}"
+              f" ({status['seconds']:.2f}s){': ' + status['error'] if 'error' in status else ''}")
+    elapsed = time.perf_counter() - start
+
+    # Save the status of every image
+    if report:
+        with open(report, 'w') as file:
+            file.writelines(json.dumps(status) + "\n" for status in statuses)
+        print(f"The report is saved as {report}.")
+
+    # Aggregate throughput
+    ok = sum(status["status"] == "ok" for status in statuses)
+    size = sum(status["bytes"] for status in statuses) / 1e6
+    print(f"\n{ok}/{len(statuses)} images were processed successfully in {elapsed:.2f}s "
+          f"({len(statuses)/max(elapsed, 1e-9):.1f} images/s, {size/max(elapsed, 1e-9):.2f} MB/s).")
+
+    # Share of the processing time spent encoding the results
+    encode = sum(status.get("encode_seconds", 0) for status in statuses)
+    if encode:
+        busy = sum(status["seconds"] for status in statuses)
+        print(f"Encoding the results took {encode:.2f}s ({encode/max(busy, 1e-9):.0%} of the processing time).")
+
+    # Time spent in every stage
+    if statsTarget:
+        saveStats(aggregate(statuses), statsTarget)
@@ -0,0 +1,230 @@
+import contextlib
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import numpy as np
+import PIL
+from PIL import Image
+from read import readHeader, readPayload, toAlnum
+from stats import getRSS
+from write import getLimit, setLSB, toBinary, writeMessage
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Steganography benchmark tool.
+"""
+
+def printDoc():
+    """Displays the documentation of the script and exits"""
+
+    print("""[steganographyBench.py]
+Measures the throughput of the writing and reading tools on synthetic images.
+
+Every carrier is measured on the decode and encode stages, and every lsb,
+channels and payload combination on the toBinary, embed, extract and toAlnum
+stages. Each stage reports its time, MB/s and pixels/s on the carrier, and
+its peak memory allocation.
+
+Flags:
+    -h: Displays this message and exits.
+    -sizes: Comma separated carrier sizes in megapixels (0.1,1,10,50).
+    -modes: Comma separated carrier modes among gray and rgb (gray,rgb).
+    -n: Comma separated numbers of LSB (1,2,4,8).
+    -channels: Comma separated channel subsets of rgb carriers (RGB,R,GB).
+    -fill: Comma separated payload sizes as a fraction of the capacity (0,0.01,1).
+    -repeat: The number of runs of each stage, the fastest is kept (3).
+    -o: Saves the results to a .json file.
+    -compare: Compares the results to a previous .json file.
+
+Example:
+    python ./bench.py -sizes 0.1,1 -n 1,8 -o <results.json> | -flags
+""")
+    exit(0)
+
+def getCarrier(megapixels, mode, seed = 0):
+    """Generates a noise image and its PNG encoding."""
+
+    side = int(np.sqrt(megapixels * 1e6))
+    shape = (side, side) if mode == "gray" else (side, side, 3)
+    image = np.random.default_rng(seed).integers(0, 256, shape, dtype=np.uint8)
+
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG", compress_level=1)
+
+    return image, buffer.getvalue()
+
+def getPayload(nchars, seed = 0):
+    """Generates printable ASCII text."""
+    return np.random.default_rng(seed).integers(32, 127, nchars, dtype=np.uint8).tobytes().decode("ascii")
+
+def measure(function, repeat = 3):
+    """Runs a function, returns its result, fastest time and peak allocation in MB.
+
+    The runs are timed without tracing the allocations, which slows them
+    down, the peak allocation being taken by an extra run.
+    """
+
+    # Discard the messages printed by the tools
+    with contextlib.redirect_stdout(io.StringIO()):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = function()
+            best = min(best, time.perf_counter() - start)
+
+        tracemalloc.start()
+        function()
+        peak = tracemalloc.get_traced_memory()[1] / 1e6
+        tracemalloc.stop()
+
+    return result, best, peak
+
+def getRecord(stage, image, seconds, peak, **params):
+    """Builds the result of one stage."""
+
+    pixels = image.shape[0] * image.shape[1]
+    record = dict(params, stage=stage, pixels=pixels, seconds=seconds,
+                  mb_per_s=image.nbytes / 1e6 / max(seconds, 1e-9),
+                  pixels_per_s=pixels / max(seconds, 1e-9), peak_mb=peak)
+    rss = getRSS()
+    if rss is not None:
+        record["rss_mb"] = rss
+
+    return record
+
+def runBench(sizes, modes, lsbs, channelSets, fills, repeat = 3):
+    """Runs every stage on every combination, yields their results."""
+
+    for megapixels in sizes:
+        for mode in modes:
+            image, png = getCarrier(megapixels, mode)
+            carrier = {"megapixels": megapixels, "mode": mode}
+
+            # Stages only depending on the carrier
+            _, seconds, peak = measure(lambda: np.array(Image.open(io.BytesIO(png))), repeat)
+            yield getRecord("decode", image, seconds, peak, **carrier)
+
+            def encode():
+                buffer = io.BytesIO()
+                Image.fromarray(image).save(buffer, format="PNG")
+            _, seconds, peak = measure(encode, repeat)
+            yield getRecord("encode", image, seconds, peak, **carrier)
+
+            for lsb in lsbs:
+                # Per-sample replacement of a thousand samples
+                samples = image.reshape(-1)[:1000]
+                _, seconds, peak = measure(lambda: [setLSB(int(x), 1, lsb) for x in samples], repeat)
+                yield dict(getRecord("setLSB", image, seconds, peak, lsb=lsb, **carrier),
+                           samples_per_s=len(samples) / max(seconds, 1e-9))
+
+                for channels in (channelSets if mode == "rgb" else ["L"]):
+                    flags = {"nored": "R" not in channels, "nogreen": "G" not in channels,
+                             "noblue": "B" not in channels}
+                    limit = getLimit(image.shape, lsb, **flags)
+
+                    for fill in fills:
+                        message = getPayload(int(limit * fill))
+                        params = dict(carrier, lsb=lsb, channels=channels, fill=fill,
+                                      payload_bytes=len(message))
+
+                        bits, seconds, peak = measure(lambda: toBinary(message), repeat)
+                        yield getRecord("toBinary", image, seconds, peak, **params)
+
+                        imgOut, seconds, peak = measure(
+                            lambda: writeMessage(image, bits, lsb, header=True, **flags), repeat)
+                        yield getRecord("embed", image, seconds, peak, **params)
+
+                        data, seconds, peak = measure(lambda: readPayload(imgOut, readHeader(imgOut)), repeat)
+                        yield getRecord("extract", image, seconds, peak, **params)
+
+                        text, seconds, peak = measure(lambda: toAlnum(data), repeat)
+                        yield getRecord("toAlnum", image, seconds, peak, **params)
+
+                        if text != message:
+                            print(f"The extracted message differs from the written one ({params}).")
+
+def getKey(record):
+    """Returns the parameters identifying a result."""
+    return tuple(record.get(key) for key in ("stage", "megapixels", "mode", "lsb", "channels", "fill"))
+
+def getMetadata():
+    """Returns the versions the benchmark ran with."""
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = ""
+
+    return {"commit": commit, "python": platform.python_version(), "numpy": np.__version__,
+            "pillow": PIL.__version__, "machine": platform.machine(), "time": time.time()}
+
+if __name__ == "__main__":
+    print("")
+
+    # Get arguments
+    args = sys.argv[1:]
+
+    # Show the documentation if needed
+    if "-h" in args:
+        printDoc()
+
+    # Flags
+    sizes, modes, lsbs = [0.1, 1, 10, 50], ["gray", "rgb"], [1, 2, 4, 8]
+    channelSets, fills, repeat = ["RGB", "R", "GB"], [0, 0.01, 1], 3
+    output, compare = None, None
+
+    # Update flags
+    try:
+        if "-sizes" in args:
+            sizes = [float(x) for x in args[args.index("-sizes") + 1].split(",")]
+        if "-modes" in args:
+            modes = args[args.index("-modes") + 1].split(",")
+        if "-n" in args:
+            lsbs = [int(x) for x in args[args.index("-n") + 1].split(",")]
+        if "-channels" in args:
+            channelSets = args[args.index("-channels") + 1].upper().split(",")
+        if "-fill" in args:
+            fills = [float(x) for x in args[args.index("-fill") + 1].split(",")]
+        if "-repeat" in args:
+            repeat = int(args[args.index("-repeat") + 1])
+        if "-o" in args:
+            output = args[args.index("-o") + 1]
+        if "-compare" in args:
+            compare = args[args.index("-compare") + 1]
+    except (IndexError, ValueError):
+        print("A flag is missing its value, or its value is not a comma separated list.\n")
+        exit(1)
+
+    if any(lsb < 1 or lsb > 8 for lsb in lsbs):
+        print("The amount of least significant bits must be between 1 and 8.")
+        exit(1)
+
+    # Run the benchmark
+    results = []
+    print(f"{'stage':<9}{'mode':<6}{'MP':>6}{'n':>3}{'ch':>5}{'fill':>6}{'s':>10}{'MB/s':>10}{'Mpx/s':>10}{'peak MB':>9}")
+    for record in runBench(sizes, modes, lsbs, channelSets, fills, repeat):
+        results.append(record)
+        print(f"{record['stage']:<9}{record['mode']:<6}{record['megapixels']:>6}"
+              f"{record.get('lsb', ''):>3}{record.get('channels', ''):>5}{record.get('fill', ''):>6}"
+              f"{record['seconds']:>10.4f}{record['mb_per_s']:>10.1f}"
+              f"{record['pixels_per_s']/1e6:>10.2f}{record['peak_mb']:>9.1f}")
+
+    # Save the results
+    if output:
+        with open(output, 'w') as file:
+            json.dump({"metadata": getMetadata(), "results": results}, file, indent=1)
+        print(f"\nThe results are saved as {output}.")
+
+    # Compare to previous results
+    if compare:
+        previous = {getKey(record): record for record in json.load(open(compare))["results"]}
+        print(f"\nSpeedup over {compare} (previous time / current time):")
+        for record in results:
+            if getKey(record) in previous:
+                ratio = previous[getKey(record)]["seconds"] / max(record["seconds"], 1e-9)
+                print(f"{' '.join(str(x) for x in getKey(record) if x is not None)}: {ratio:.2f}x")
@@ -0,0 +1,88 @@
+import hashlib
+import io
+import numpy as np
+from collections import OrderedDict
+from PIL import Image
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Cache of decoded images.
+
+Images are keyed by the hash of their encoded bytes, so that an image read
+several times (with different parameters, or under different names) is only
+decoded once. The least recently used images are evicted once the decoded
+arrays exceed the memory budget. Cached arrays are read-only: they must be
+copied before being written to.
+"""
+
+class ImageCache:
+    """Least recently used cache of decoded images."""
+
+    def __init__(self, budget = 256e6):
+        """Creates an empty cache holding up to budget bytes of decoded arrays."""
+
+        self.budget = int(budget)
+        self.images = OrderedDict()
+        self.size = 0
+        self.hits, self.misses = 0, 0
+
+    def getKey(self, data):
+        """Returns the key of encoded image bytes."""
+        return hashlib.blake2b(data, digest_size=16).digest()
+
+    def get(self, source):
+        """Returns the decoded array of an image file path, buffer or encoded bytes."""
+
+        # Read the encoded bytes to hash them
+        if isinstance(source, str):
+            with open(source, 'rb') as file:
+                data = file.read()
+        elif isinstance(source, io.IOBase):
+            data = source.read()
+        else:
+            data = bytes(source)
+
+        key = self.getKey(data)
+        if key in self.images:
+            self.hits += 1
+            self.images.move_to_end(key)
+            return self.images[key]
+
+        self.misses += 1
+        image = np.array(Image.open(io.BytesIO(data)))
+
+        # Arrays larger than the whole budget are not kept
+        if image.nbytes > self.budget:
+            return image
+
+        image.setflags(write=False)
+        self.images[key] = image
+        self.size += image.nbytes
+
+        # Evict the least recently used images
+        while self.size > self.budget:
+            _, evicted = self.images.popitem(last=False)
+            self.size -= evicted.nbytes
+
+        return image
+
+    def clear(self):
+        """Removes every image from the cache."""
+
+        self.images.clear()
+        self.size = 0
+
+# Decoded images kept by the worker process, in process pools
+workerCache = None
+
+def setCache(budget):
+    """Creates the image cache of a worker process (used as the initializer
+    of process pools)."""
+
+    global workerCache
+    workerCache = ImageCache(budget) if budget else None
+
+def getCache():
+    """Returns the image cache of the worker process, or None."""
+    return workerCache
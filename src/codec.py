@@ -0,0 +1,174 @@
+import io
+import numpy as np
+from PIL import Image
+import fec
+from header import COMPRESSIONS, FLAG_BINARY, FLAG_FEC, LEVELS, compress, getOffset
+from read import readHeader, readMessage, readPayload
+from samples import getChannels
+from write import embedBits, getBits
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Steganography library interface.
+
+A StegoCodec holds one writing configuration and hides or reads payloads in
+images held in memory, without any file or process. It can be kept by a long
+running worker and reused for every image.
+
+Example:
+    codec = StegoCodec(lsb = 2, noblue = True)
+    stego = codec.embed(pngBytes, b"message")
+    payload = codec.extract(stego)
+
+Parameter sweeps over one image decode it once when the codecs share a cache:
+    cache = ImageCache()
+    codecs = [StegoCodec(lsb = n, header = False, cache = cache) for n in range(1, 9)]
+"""
+
+# Lossless formats of the encoded images, the only ones keeping the payload
+FORMATS = ("PNG", "TIFF", "BMP")
+
+class StegoCodec:
+    """Reusable writing and reading configuration."""
+
+    def __init__(self, lsb = 1, nored = False, nogreen = False, noblue = False,
+                 header = True, format = "PNG", compression = None, level = None,
+                 cache = None, key = None, correction = False, matrix = 0):
+        """Checks and precomputes a configuration.
+
+        Encoded images are decoded through cache (an ImageCache) if one is given.
+        Payloads are scattered over the images by the key, if any, and
+        protected by error correcting codes if correction is set. A matrix
+        code parameter k writes them by matrix embedding on the least
+        significant bit (lsb is then ignored).
+        """
+
+        if lsb < 1 or lsb > 8:
+            raise ValueError("The amount of least significant bits must be between 1 and 8.")
+        if (compression or correction or matrix) and not header:
+            raise ValueError("Compressed, protected or matrix embedded payloads need the header.")
+        if format.upper() not in FORMATS:
+            raise ValueError("The format of encoded images must be PNG, TIFF or BMP.")
+        if matrix < 0 or matrix > 7:
+            raise ValueError("The matrix code parameter must be between 1 and 7.")
+        if compression and compression not in COMPRESSIONS[1:]:
+            raise ValueError("The compression algorithm must be zlib, bz2 or lzma.")
+        if compression and level is not None and not LEVELS[compression][0] <= level <= LEVELS[compression][1]:
+            raise ValueError(f"The {compression} compression level must be between {LEVELS[compression][0]} and {LEVELS[compression][1]}.")
+
+        self.lsb = lsb
+        self.nored, self.nogreen, self.noblue = nored, nogreen, noblue
+        self.header = header
+        self.format = format
+        self.compression, self.level = compression, level
+        self.cache = cache
+        self.key = key
+        self.correction = correction
+        self.matrix = matrix
+
+        # Channels shared by every image
+        self.channels = getChannels(nored, nogreen, noblue)
+
+        # Capacities of the image shapes already seen
+        self.capacities = {}
+
+    def capacity(self, shape):
+        """Returns the number of payload bytes an image of this shape can hold
+        (before compression, and error correcting codes which halve it)."""
+
+        shape = tuple(shape)
+        if shape not in self.capacities:
+            offset = getOffset(shape) if self.header else 0
+            capacity = getBits(shape, self.lsb, self.channels, offset, self.matrix) // 8
+            self.capacities[shape] = capacity // 2 if self.correction else capacity
+
+        return self.capacities[shape]
+
+    def decode(self, image):
+        """Returns an image as a numpy array, decoding encoded image bytes."""
+
+        encoded = isinstance(image, (bytes, bytearray, memoryview, io.IOBase))
+        if encoded and self.cache is not None:
+            return self.cache.get(image)
+
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = io.BytesIO(image)
+        if isinstance(image, io.IOBase):
+            return np.array(Image.open(image))
+
+        return np.asarray(image)
+
+    def encode(self, image):
+        """Returns a numpy array as encoded image bytes."""
+
+        buffer = io.BytesIO()
+        Image.fromarray(image).save(buffer, format=self.format)
+
+        return buffer.getvalue()
+
+    def embed(self, image, payload, inplace = False):
+        """Hides a payload in an image.
+
+        The image is a numpy array, or encoded image bytes or buffer, in which
+        case the result is encoded in the codec format. The payload is bytes or
+        text. Raises a ValueError if it does not fit in the image.
+        """
+
+        encoded = not isinstance(image, np.ndarray)
+        array = self.decode(image)
+
+        # Text is marked as such in the header, bytes as binary data
+        flags = 0 if isinstance(payload, str) else FLAG_BINARY
+        if isinstance(payload, str):
+            payload = payload.encode("latin-1", errors="replace")
+
+        payload, compressed = compress(payload, self.compression, self.level)
+        flags |= compressed
+
+        if len(payload) > self.capacity(array.shape):
+            raise ValueError(f"The payload ({len(payload)} bytes) does not fit into the image "
+                             f"({self.capacity(array.shape)} bytes).")
+
+        if self.correction:
+            payload = fec.encode(payload)
+            flags |= FLAG_FEC
+
+        # Write on a copy unless the array can be modified (decoded images are,
+        # unless they are held by the cache)
+        if not array.flags.writeable or (not encoded and not inplace):
+            array = np.array(array)
+
+        # Right-pad headerless payloads to whole symbols, as they are read
+        # most significant bit first (embedBits pads the others)
+        bits = np.unpackbits(np.frombuffer(payload, dtype=np.uint8))
+        if not self.header:
+            bits = np.concatenate((bits, np.zeros(-len(bits) % self.lsb, dtype=np.uint8)))
+        embedBits(array, bits, self.lsb, self.nored, self.nogreen, self.noblue, self.header, flags,
+                  key = self.key, matrix = self.matrix)
+
+        return self.encode(array) if encoded else array
+
+    def extract(self, image, nchars = 0, stats = None):
+        """Reads the payload hidden in an image.
+
+        Images with a header are read with the parameters it holds. Headerless
+        images are read with the codec configuration, up to nchars bytes (the
+        whole image if 0). Raises a ValueError if the payload is corrupted.
+        The error correction statistics are stored in the stats dict, if any.
+        """
+
+        array = self.decode(image)
+
+        header = readHeader(array) if self.header else None
+        if header:
+            data = readPayload(array, header, key = self.key, stats = stats)
+            if data is None:
+                raise ValueError("The payload does not match the checksum of its header.")
+            return data
+
+        if self.header:
+            raise ValueError("The image holds no header.")
+
+        return readMessage(array, nchars, self.lsb, self.nored, self.nogreen, self.noblue,
+                           key = self.key)
@@ -0,0 +1,56 @@
+import numpy as np
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Forward error correction of hidden payloads.
+
+Every half byte of the payload is written as an extended Hamming (8, 4)
+codeword, which corrects one flipped bit and detects two. The bits of the
+codewords are interleaved, bit i of every codeword being written before bit
+i + 1 of any, so that the bits of one sample (or of neighbouring samples)
+belong to different codewords.
+"""
+
+def getCodeword(nibble):
+    """Returns the extended Hamming (8, 4) codeword of a half byte."""
+
+    d1, d2, d3, d4 = (nibble >> 3) & 1, (nibble >> 2) & 1, (nibble >> 1) & 1, nibble & 1
+    bits = [d1 ^ d2 ^ d4, d1 ^ d3 ^ d4, d1, d2 ^ d3 ^ d4, d2, d3, d4]
+    bits.append(sum(bits) & 1)
+
+    return int("".join(str(bit) for bit in bits), 2)
+
+# Codeword of every half byte
+ENCODE = np.array([getCodeword(nibble) for nibble in range(16)], dtype=np.uint8)
+
+# Closest half byte to every received byte, and the number of flipped bits
+# (2 when two codewords are as close, and the error cannot be corrected)
+DISTANCES = np.array([[bin(byte ^ int(codeword)).count("1") for codeword in ENCODE]
+                      for byte in range(256)])
+DECODE = DISTANCES.argmin(axis=1).astype(np.uint8)
+ERRORS = DISTANCES.min(axis=1).astype(np.uint8)
+
+def encode(data):
+    """Returns the interleaved codewords of bytes (twice their size)."""
+
+    values = np.frombuffer(data, dtype=np.uint8)
+    codewords = ENCODE[np.stack((values >> 4, values & 15), axis=1).reshape(-1)]
+
+    # Write bit i of every codeword, then bit i + 1
+    return np.packbits(np.unpackbits(codewords).reshape(-1, 8).T).tobytes()
+
+def decode(data):
+    """Returns the bytes held by interleaved codewords, and the numbers of
+    corrected and uncorrectable codewords."""
+
+    values = np.frombuffer(data, dtype=np.uint8)
+    values = values[:len(values) - len(values) % 2]
+    codewords = np.packbits(np.unpackbits(values).reshape(8, -1).T, axis=1).reshape(-1)
+
+    nibbles = DECODE[codewords]
+    errors = ERRORS[codewords]
+
+    data = (nibbles[0::2] << 4 | nibbles[1::2]).tobytes()
+
+    return data, int(np.count_nonzero(errors == 1)), int(np.count_nonzero(errors == 2))
@@ -0,0 +1,132 @@
+import bz2
+import lzma
+import struct
+import zlib
+from samples import getCapacity, getChannels
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Self-describing header written in front of the hidden payload.
+
+The header is written on the least significant bit of every color channel of
+the first pixels of the image, so that it can be read without knowing the
+parameters of the payload. The payload starts on the first pixel after it.
+"""
+
+# Header fields: magic, version, lsb, channel mask, flags, length, checksum
+MAGIC = b"STG"
+VERSION = 1
+FORMAT = ">3sBBBBII"
+SIZE = struct.calcsize(FORMAT)
+
+# Channels the header is written to (every channel of the image)
+CHANNELS = getChannels()
+
+# Flags: the payload is binary data to be saved as is, instead of ASCII text
+FLAG_BINARY = 1
+
+# Compression algorithms, whose index is stored in bits 1 and 2 of the flags
+COMPRESSIONS = (None, "zlib", "bz2", "lzma")
+COMPRESSION_SHIFT = 1
+COMPRESSION_MASK = 0b110
+
+# Levels accepted by every compression algorithm
+LEVELS = {"zlib": (0, 9), "bz2": (1, 9), "lzma": (0, 9)}
+
+# Flags: the payload is scattered by a keyed permutation of the samples
+FLAG_SCATTER = 8
+
+# Flags: the payload is protected by error correcting codes, the checksum
+# being the one of the codewords without errors
+FLAG_FEC = 16
+
+# Matrix embedding code parameter k (0 when unused), stored in bits 5 to 7 of
+# the flags: k bits are written on every block of 2**k - 1 samples
+MATRIX_SHIFT = 5
+MATRIX_MASK = 0b11100000
+
+def getOffset(shape):
+    """Returns the index of the first pixel after the header."""
+
+    # Number of samples available on every pixel
+    perPixel = getCapacity((1, 1) + tuple(shape[2:]), CHANNELS)
+
+    return -(-SIZE * 8 // perPixel)
+
+def toMask(nored = False, nogreen = False, noblue = False):
+    """Converts channel flags to a bit mask (bit 0 for R, 1 for G, 2 for B)."""
+    return int(not nored) | int(not nogreen) << 1 | int(not noblue) << 2
+
+def fromMask(mask):
+    """Converts a bit mask to the nored, nogreen and noblue flags."""
+    return not mask & 1, not mask & 2, not mask & 4
+
+def packHeader(data, lsb = 1, nored = False, nogreen = False, noblue = False,
+               flags = 0):
+    """Builds the header describing a payload."""
+    return struct.pack(FORMAT, MAGIC, VERSION, lsb, toMask(nored, nogreen, noblue),
+                       flags, len(data), zlib.crc32(data))
+
+def parseHeader(data):
+    """Parses a header, returns None if the data does not hold one."""
+
+    if len(data) < SIZE:
+        return None
+
+    magic, version, lsb, mask, flags, length, checksum = struct.unpack(FORMAT, data[:SIZE])
+
+    # Reject data that was not written with a known header
+    if magic != MAGIC or version != VERSION or not 1 <= lsb <= 8:
+        return None
+
+    nored, nogreen, noblue = fromMask(mask)
+    return {"lsb": lsb, "nored": nored, "nogreen": nogreen, "noblue": noblue,
+            "flags": flags, "length": length, "checksum": checksum}
+
+def compress(data, algorithm = None, level = None):
+    """Compresses a payload, returns it with its compression flags.
+
+    The payload is kept uncompressed when compression does not make it smaller.
+    Raises a ValueError if the algorithm is unknown or the level is not
+    accepted by it.
+    """
+
+    if algorithm is None:
+        return data, 0
+
+    if algorithm not in COMPRESSIONS[1:]:
+        raise ValueError("The compression algorithm must be zlib, bz2 or lzma.")
+
+    if level is not None and not LEVELS[algorithm][0] <= level <= LEVELS[algorithm][1]:
+        raise ValueError(f"The {algorithm} compression level must be between {LEVELS[algorithm][0]} and {LEVELS[algorithm][1]}.")
+
+    if algorithm == "zlib":
+        packed = zlib.compress(data, 6 if level is None else level)
+    elif algorithm == "bz2":
+        packed = bz2.compress(data, 9 if level is None else level)
+    elif algorithm == "lzma":
+        packed = lzma.compress(data, preset=level)
+
+    if len(packed) >= len(data):
+        return data, 0
+
+    return packed, COMPRESSIONS.index(algorithm) << COMPRESSION_SHIFT
+
+def decompress(data, flags):
+    """Decompresses a payload according to the flags of its header."""
+
+    algorithm = COMPRESSIONS[(flags & COMPRESSION_MASK) >> COMPRESSION_SHIFT]
+
+    if algorithm == "zlib":
+        return zlib.decompress(data)
+    if algorithm == "bz2":
+        return bz2.decompress(data)
+    if algorithm == "lzma":
+        return lzma.decompress(data)
+
+    return data
+
+def checkPayload(header, data):
+    """Returns True if the payload matches the checksum of its header."""
+    return len(data) == header["length"] and zlib.crc32(data) == header["checksum"]
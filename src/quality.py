@@ -0,0 +1,111 @@
+import numpy as np
+from header import SIZE, fromMask, getOffset
+from samples import getCapacity, getChannels, getLayout
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Image quality measures and capacity planning.
+
+The distortion of a message is predicted without writing it: replacing the n
+least significant bits of a sample by random bits changes it by the
+difference of two uniform n-bit values, whose mean square is (4**n - 1) / 6.
+"""
+
+def getMSE(image, other):
+    """Returns the mean square error between two images.
+
+    Only the samples that differ are converted to floats, as a message
+    changes few of them.
+    """
+
+    changed = np.flatnonzero(image != other)
+    difference = image.take(changed).astype(np.float64) - other.take(changed)
+
+    return float(np.dot(difference, difference) / image.size)
+
+def getPSNR(image, other):
+    """Returns the peak signal to noise ratio between two 8-bit images, in dB."""
+    return toPSNR(getMSE(image, other))
+
+def toPSNR(mse):
+    """Converts a mean square error of 8-bit samples to a PSNR in dB."""
+    return float("inf") if mse == 0 else float(10 * np.log10(255 ** 2 / mse))
+
+def boxMean(x, size):
+    """Returns the mean of every size x size window of a 2D array (valid windows only)."""
+
+    total = np.pad(x.cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    sums = total[size:, size:] - total[:-size, size:] - total[size:, :-size] + total[:-size, :-size]
+
+    return sums / size ** 2
+
+def getSSIM(image, other, size = 7):
+    """Returns the mean structural similarity between two 8-bit images.
+
+    Statistics are computed on uniform size x size windows of every channel.
+    """
+
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    image = image.astype(np.float64).reshape(image.shape[0], image.shape[1], -1)
+    other = other.astype(np.float64).reshape(image.shape)
+
+    # Images smaller than a window are compared as a whole
+    size = min(size, image.shape[0], image.shape[1])
+
+    ssims = []
+    for ch in range(image.shape[2]):
+        x, y = image[:, :, ch], other[:, :, ch]
+        mx, my = boxMean(x, size), boxMean(y, size)
+        vx = boxMean(x * x, size) - mx * mx
+        vy = boxMean(y * y, size) - my * my
+        cxy = boxMean(x * y, size) - mx * my
+        ssims.append(np.mean((2 * mx * my + c1) * (2 * cxy + c2) / ((mx * mx + my * my + c1) * (vx + vy + c2))))
+
+    return float(np.mean(ssims))
+
+def predictMSE(shape, nbytes, lsb = 1, header = True):
+    """Returns the expected mean square error of writing nbytes on an image.
+
+    The error does not depend on the channels, which only set the capacity.
+    """
+
+    # Samples changed by the message, and by the header on 1 lsb
+    samples = -(-nbytes * 8 // lsb)
+    error = samples * (4 ** lsb - 1) / 6
+    if header:
+        error += SIZE * 8 * 0.5
+
+    return float(error / np.prod(shape))
+
+def getPlans(shape, nbytes, header = True):
+    """Returns the capacity and expected distortion of every lsb and channel combination."""
+
+    gray = len(shape) == 2
+
+    plans = []
+    for lsb in range(1, 9):
+        for mask in ([7] if gray else range(7, 0, -1)):
+            nored, nogreen, noblue = fromMask(mask)
+            channels = getChannels(nored, nogreen, noblue)
+            if not getLayout(shape, channels)[1]:
+                continue
+
+            offset = getOffset(shape) if header else 0
+            capacity = getCapacity(shape, channels, offset) * lsb // 8
+            mse = predictMSE(shape, nbytes, lsb, header)
+            plans.append({"lsb": lsb, "nored": nored, "nogreen": nogreen, "noblue": noblue,
+                          "channels": len(getLayout(shape, channels)[1]), "capacity": capacity,
+                          "mse": mse, "psnr": toPSNR(mse)})
+
+    return plans
+
+def choosePlan(plans, nbytes, psnr = None, mse = None):
+    """Returns the plan holding nbytes with the lowest distortion within a budget, or None."""
+
+    fitting = [plan for plan in plans if plan["capacity"] >= nbytes
+               and (psnr is None or plan["psnr"] >= psnr)
+               and (mse is None or plan["mse"] <= mse)]
+
+    # Leave as many channels untouched as possible on equal distortion
+    return min(fitting, key=lambda plan: (plan["mse"], plan["channels"]), default=None)
@@ -1,6 +1,12 @@
+import io
 import numpy as np
 import sys
 from PIL import Image
+from tiles import TiledImage
+import fec
+from header import FLAG_BINARY, FLAG_FEC, FLAG_SCATTER, MATRIX_MASK, MATRIX_SHIFT, SIZE, checkPayload, decompress, fromMask, getOffset, parseHeader
+from samples import getCapacity, getChannels, getIndices, getLayout, runChunks
+from stats import Stats, saveStats
 
 """
 Valérian Grégoire--Bégranger - 2024
@@ -8,6 +14,9 @@ Valérian Grégoire--Bégranger - 2024
 Steganography reading tool.
 """
 
+# Text output formats (binary messages are saved to any file)
+OUTPUT_FORMATS = (".txt", ".msg", ".doc")
+
 def printDoc():
     """Displays the documentation of the script and exits"""
 
@@ -16,11 +25,28 @@ Reads hidden text from an image.
 
 Flags:
     -h: Displays this message and exits.
-    -nored: The R channel in RGB will remain untouched.
-    -nogreen: The G channel in RGB will remain untouched.
-    -noblue: The B channel in RGB will remain untouched.
+    -nored: The message was not written on the R channel in RGB.
+    -nogreen: The message was not written on the G channel in RGB.
+    -noblue: The message was not written on the B channel in RGB.
     -l: The number of characters to read from the image.
     -n: The number of LSB the message are written on.
+    -j: The number of threads reading the image (1 by default).
+    -tile: Reads the image by strips of the given number of rows, without
+           copying it in memory (uncompressed .bmp/.tiff files are mapped).
+    -key: The key the message was scattered with by write.py.
+    -stats: Prints the time spent in every stage as a JSON line (-stats json),
+            or saves it to a .json file.
+    -tracemalloc: Adds the peak memory allocation of every stage to -stats.
+    -profile: Saves a cProfile profile of the run to a file.
+    -auto: Detects the -n and channel flags of images without header, by
+           scoring the first bytes read with every combination.
+
+The -l, -n and channel flags are only used when the image holds no header
+(images written by write.py with the -raw flag). The header itself is read
+on every channel of the first pixels.
+
+The input and output paths can be - to use the standard input and output
+(the messages are then sent to stderr).
 
 Example:
     python ./read.py <imagePath.jpg> <outputPath.png> | -flags
@@ -28,24 +54,11 @@ Example:
     exit(0)
 
 def toAlnum(message):
-    """Converts a binary string to ASCII compliant text."""
-
-    # Output alphabetical string
-    output = ''
-
-    # Split the message in bytes to convert each char later on
-    bytes = [[]]
-    while len(message):
-        if not (len(bytes[-1]) < 8):
-            bytes.append([])
-        bytes[-1].append(message[0])
-        message = message[1:]
-
-    # Convert each byte to ASCII code
-    for byte_ in bytes:
-        output += chr(int(''.join(byte_), 2))
-    
-    return ''.join(char if ord(char) < 128 else ' ' for char in output)
+    """Converts bytes to ASCII compliant text."""
+
+    # Replace every non ASCII byte by a space
+    table = bytes(range(128)) + b" " * 128
+    return message.translate(table).decode("ascii")
 
 def getImage(filePath):
     """Imports and converts an image file to a numpy array."""
@@ -69,57 +82,295 @@ def getImage(filePath):
     return img, gray
 
 def readMessage(image, nchars, lsb = 1,
-                nored = False, nogreen = False, noblue = False):
-    """Reads the least significant bits of pixels from an image"""
-
-    # Get array dimensions to differentiate between RGB and grayscale
-    try:
-        height, width, depth = image.shape
-        gray = False
-    except ValueError:
-        height, width = image.shape
-        depth = 0
-        gray = True
+                nored = False, nogreen = False, noblue = False, offset = 0,
+                workers = 1, key = None, progress = None):
+    """Reads the least significant bits of pixels from an image, scattered by the key if any"""
+
+    # Channels to read from
+    channels = getChannels(nored, nogreen, noblue)
+
+    # Only read the samples holding the requested characters, never more than
+    # the image holds
+    count = getCapacity(image.shape, channels, offset)
+    if nchars:
+        count = min(count, -(-nchars * 8 // lsb))
+
+    mask = np.uint8((1 << lsb) - 1)
+    shifts = np.arange(lsb - 1, -1, -1, dtype=np.uint8)
+    bits = np.empty((count, lsb), dtype=np.uint8)
 
-    # Function output
-    message = []
+    def readChunk(start, stop):
+        # Flat indices of the samples to read from, in row-major and R,G,B order
+        indices = getIndices(image.shape, stop - start, channels, offset, start, key)
+
+        # Mask the least significant bits of every sample
+        symbols = image.take(indices) & mask
+
+        # Split the symbols into bits, most significant first
+        bits[start:stop] = (symbols[:, None] >> shifts) & 1
+
+    # Arrays are read by chunks on workers threads, tiled images on one
+    runChunks(readChunk, count, workers if isinstance(image, np.ndarray) else 1, progress = progress)
+    bits = bits.reshape(-1)
+
+    # Keep whole characters only
+    if nchars:
+        bits = bits[:nchars * 8]
+    bits = bits[:len(bits) - len(bits) % 8]
+
+    return np.packbits(bits).tobytes()
+
+def readSyndromes(image, nchars, k, nored = False, nogreen = False, noblue = False,
+                  offset = 0, workers = 1, key = None, progress = None):
+    """Reads characters written by matrix embedding: the syndromes of the
+    least significant bits of blocks of 2**k - 1 samples."""
 
     # Channels to read from
-    channels = []
-    if not nored:
-        channels.append(0)
-    if not nogreen:
-        channels.append(1)
-    if not noblue:
-        channels.append(2)
-
-    # Reading loop
-    for i in range(height):
-        for j in range(width):
-            # Grayscale computations
-            if gray:
-                data = "{:08}".format(int(bin(image[i,j])[2:]))[-lsb:]
-                for dat in data:
-                    message.append(dat)
-                if nchars and len(message) >= nchars * 8:
-                    return "".join(message)
-            
-            # RGB computations
-            else:
-                for ch in channels:
-                    data = "{:08}".format(int(bin(image[i,j,ch])[2:]))[-lsb:]
-                    for dat in data:
-                        message.append(dat)
-                    if nchars and len(message) >= nchars * 8:
-                        return "".join(message)
-    
-    return "".join(message)
+    channels = getChannels(nored, nogreen, noblue)
+
+    size = (1 << k) - 1
+    columns = np.arange(1, size + 1, dtype=np.uint8)
+    shifts = np.arange(k - 1, -1, -1, dtype=np.uint8)
+
+    # Only read the blocks holding the requested characters
+    count = min(-(-nchars * 8 // k), getCapacity(image.shape, channels, offset) // size)
+    bits = np.empty((count, k), dtype=np.uint8)
+
+    def readChunk(start, stop):
+        indices = getIndices(image.shape, (stop - start) * size, channels, offset, start * size, key)
+        syndromes = np.bitwise_xor.reduce((image.take(indices).reshape(-1, size) & 1) * columns, axis=1)
+        bits[start:stop] = (syndromes[:, None] >> shifts) & 1
+
+    runChunks(readChunk, count, workers if isinstance(image, np.ndarray) else 1, progress = progress)
+    bits = bits.reshape(-1)[:nchars * 8]
+
+    return np.packbits(bits[:len(bits) - len(bits) % 8]).tobytes()
+
+def getScore(data):
+    """Returns the printable ratio and the negated entropy (in bits) of bytes."""
+
+    values = np.frombuffer(data, dtype=np.uint8)
+    if not len(values):
+        return 0, 0
+
+    printable = np.mean(((values >= 32) & (values < 127)) | np.isin(values, (9, 10, 13)))
+    counts = np.bincount(values, minlength=256)
+    p = counts[counts > 0] / len(values)
+
+    return float(printable), float(np.sum(p * np.log2(p)))
+
+def detectParams(image, probe = 256):
+    """Finds the lsb and channels a headerless text message was most likely written with.
+
+    The samples of the first pixels are taken once, then the first probe bytes
+    of every lsb and channel combination are read from them and scored. Ties
+    go to the combination with the most channels, as every subset of the
+    channels of 8-bit characters written with 8 lsb is also text.
+    Returns the parameters and the printable ratio of the best combination.
+    """
+
+    depth, _ = getLayout(image.shape, getChannels())
+    gray = len(image.shape) == 2
+
+    # Samples of the pixels holding probe bytes with 1 lsb on 1 channel
+    pixels = min(probe * 8, image.shape[0] * image.shape[1])
+    samples = image.take(np.arange(pixels * depth)).reshape(pixels, depth)
+
+    best = None
+    for lsb in range(1, 9):
+        shifts = np.arange(lsb - 1, -1, -1, dtype=np.uint8)
+        for mask in ([7] if gray else range(7, 0, -1)):
+            nored, nogreen, noblue = fromMask(mask)
+            _, channels = getLayout(image.shape, getChannels(nored, nogreen, noblue))
+            if not channels:
+                continue
+
+            # Bits of the probe, in row-major and R,G,B order
+            symbols = samples[:, channels].reshape(-1)[:-(-probe * 8 // lsb)]
+            bits = ((symbols[:, None] >> shifts) & 1).reshape(-1)
+            data = np.packbits(bits[:len(bits) - len(bits) % 8]).tobytes()
+
+            printable, order = getScore(data)
+            score = printable, len(channels), order
+            if best is None or score > best[0]:
+                best = score, {"lsb": lsb, "nored": nored, "nogreen": nogreen, "noblue": noblue}
+
+    return dict(best[1], score=best[0][0])
+
+def readHeader(image):
+    """Reads the header written in front of the message, returns None if absent."""
+    return parseHeader(readMessage(image, SIZE, 1))
+
+def readPayload(image, header, workers = 1, key = None, stats = None, progress = None):
+    """Reads and decompresses the message described by a header, returns None if it is corrupted.
+
+    Scattered messages are read with the key, and are corrupted without it.
+    Messages protected by error correcting codes are corrected, the numbers of
+    corrected and uncorrectable codewords being stored in the stats dict if any.
+    The progress callback is called while the message is read (see runChunks).
+    """
+
+    # Nothing to read for empty messages
+    if not header["length"]:
+        return b""
+    if header["flags"] & FLAG_SCATTER and key is None:
+        return None
+
+    key = key if header["flags"] & FLAG_SCATTER else None
+    matrix = (header["flags"] & MATRIX_MASK) >> MATRIX_SHIFT
+    if matrix:
+        data = readSyndromes(image, header["length"], matrix,
+                             header["nored"], header["nogreen"], header["noblue"],
+                             offset = getOffset(image.shape), workers = workers, key = key,
+                             progress = progress)
+    else:
+        data = readMessage(image, header["length"], header["lsb"],
+                           header["nored"], header["nogreen"], header["noblue"],
+                           offset = getOffset(image.shape), workers = workers, key = key,
+                           progress = progress)
+
+    # Check the corrected codewords against the checksum
+    if header["flags"] & FLAG_FEC:
+        message, corrected, failed = fec.decode(data)
+        if stats is not None:
+            stats.update(corrected=corrected, uncorrectable=failed)
+        if not checkPayload(header, fec.encode(message)):
+            return None
+        return decompress(message, header["flags"])
+
+    return decompress(data, header["flags"]) if checkPayload(header, data) else None
+
+def printCorrections(stats):
+    """Displays the statistics of the error correcting codes, if any."""
+
+    if stats:
+        print(f"{stats['corrected']} codewords were corrected, {stats['uncorrectable']} could not be.")
+
+def getCorruption(header, key = None):
+    """Returns the reason a message does not match its header."""
+
+    if header["flags"] & FLAG_SCATTER and key is None:
+        return "The message is scattered over the image, it needs the -key it was written with. Exiting..."
+    return "The message does not match the checksum of its header. Exiting..."
 
 def saveMessage(message, file):
-    """Opens a file to write a message in it."""
-    open(file,'w').write(message)
+    """Opens a file to write a message (text or bytes) in it, or writes it to a buffer."""
+
+    binary = isinstance(message, bytes)
+    if not isinstance(file, str):
+        (file.buffer if binary and hasattr(file, "buffer") else file).write(message)
+        return
+
+    open(file,'wb' if binary else 'w').write(message)
+
+def printParams(shape, lsb, nored, nogreen, noblue):
+    """Displays the parameters the message is read with."""
+
+    print(f"The message will be read using the{f' {lsb}' if lsb > 1 else ''} least significant bit{'s' if lsb > 1 else ''} of each pixel.")
+    if len(shape) > 2:
+        print(f"The message will be read using the {'' if nored else 'R'}{'' if nogreen else 'G'}{'' if noblue else 'B'} color channels of each pixel.")
+
+def readData(image, nchars = 0, lsb = 1,
+             nored = False, nogreen = False, noblue = False, workers = 1,
+             key = None, progress = None, auto = False):
+    """Reads the bytes hidden in an image, with the parameters of its header if any.
+
+    Headerless images are read with the given parameters, or with the ones
+    detected by detectParams with auto. Returns the bytes and whether they
+    are binary data rather than ASCII text.
+    """
+
+    # Use the parameters written in the header when there is one
+    header = readHeader(image)
+    if header:
+        print("A header was found, the message parameters are read from it.")
+        lsb, nored, nogreen, noblue = header["lsb"], header["nored"], header["nogreen"], header["noblue"]
+        if header["flags"] & MATRIX_MASK:
+            k = (header["flags"] & MATRIX_MASK) >> MATRIX_SHIFT
+            print(f"The message was written by matrix embedding, {k} bits on every block of {(1 << k) - 1} samples.")
+    elif auto:
+        params = detectParams(image)
+        lsb, nored, nogreen, noblue = params["lsb"], params["nored"], params["nogreen"], params["noblue"]
+        print(f"No header was found, the message parameters were detected "
+              f"({params['score']:.0%} of the first characters are printable).")
+        if params["score"] < 0.9:
+            print("The image may not hold a text message, the detected parameters are uncertain.")
+    else:
+        print("No header was found, the message parameters are read from the flags.")
+    printParams(image.shape, lsb, nored, nogreen, noblue)
+
+    if not header:
+        return readMessage(image, nchars, lsb = lsb,
+                           nored=nored, nogreen=nogreen, noblue=noblue,
+                           workers=workers, key=key, progress=progress), False
+
+    stats = {}
+    data = readPayload(image, header, workers, key, stats, progress)
+    printCorrections(stats)
+    if data is None:
+        print(getCorruption(header, key))
+        exit(1)
+
+    return data, bool(header["flags"] & FLAG_BINARY)
+
+def readFile(inputFile, outputFile, nchars = 0, lsb = 1,
+             nored = False, nogreen = False, noblue = False, tile = 0,
+             workers = 1, cache = None, key = None, stats = None, progress = None,
+             auto = False, timer = None):
+    """Reads the message hidden in an image file and saves it, returns the message.
+
+    The image is decoded through cache (an ImageCache) if one is given.
+    Headerless images are read with detected parameters with auto. The stages
+    are timed by the timer (a new Stats by default), whose record is stored
+    in the stats dict, if any. The progress callback is called while the
+    message is read (see runChunks).
+    """
+
+    timer = timer or Stats()
+
+    # Get image
+    with timer.stage("decode"):
+        if tile:
+            img = TiledImage(inputFile, tile)
+        elif cache is not None:
+            img = cache.get(inputFile)
+        else:
+            img, gray = getImage(inputFile)
+
+    with timer.stage("extract"):
+        data, binary = readData(img, nchars, lsb, nored, nogreen, noblue, workers, key, progress, auto)
+
+    # Binary messages are saved as is, to any file
+    if not binary and isinstance(outputFile, str) and not outputFile.endswith(OUTPUT_FORMATS):
+        print("The format of the output file is not supported.")
+        print("Please use .txt, .msg, .doc files as output.")
+        exit(1)
+
+    # Save the obtained message, binary data as is
+    with timer.stage("save"):
+        message = data if binary else toAlnum(data)
+        saveMessage(message, outputFile)
+    if isinstance(outputFile, str):
+        print(f"The obtained message was saved to {outputFile}.")
+
+    if stats is not None:
+        stats.update(timer.record())
+
+    return message
+
+def readBytes(data, nchars = 0, lsb = 1,
+              nored = False, nogreen = False, noblue = False):
+    """Reads the bytes hidden in encoded image bytes."""
+
+    img, gray = getImage(io.BytesIO(data))
+
+    return readData(img, nchars, lsb, nored, nogreen, noblue)[0]
 
 if __name__ == "__main__":
+    # Keep the standard output for the message when it is written there
+    if sys.argv[2:3] == ["-"]:
+        sys.stdout = sys.stderr
+
     print("")
 
     # Get arguments
@@ -127,7 +378,9 @@ if __name__ == "__main__":
     
     # Flags
     gray, nored, nogreen, noblue = False, False, False, False
-    nchars, lsb = 0, 1
+    nchars, lsb, tile, workers = 0, 1, 0, 1
+    auto, key = False, None
+    statsTarget, profilePath = None, None
 
     # Show the documentation if needed
     if "-h" in args or not len(args):
@@ -141,6 +394,21 @@ if __name__ == "__main__":
             nogreen = True
         if "-noblue" in args:
             noblue = True
+        if "-auto" in args:
+            auto = True
+        try:
+            if "-stats" in args:
+                statsTarget = args[args.index("-stats") + 1]
+            if "-profile" in args:
+                profilePath = args[args.index("-profile") + 1]
+        except IndexError:
+            print("The -stats and -profile flags need to be followed by json or a file path.\n")
+            exit(1)
+        if "-key" in args:
+            if args.index("-key") + 1 >= len(args):
+                print("The -key flag needs to be followed by a text key.\n")
+                exit(1)
+            key = args[args.index("-key") + 1]
         if "-l" in args:
             try:
                 nchars = int(args[args.index("-l") + 1])
@@ -151,6 +419,20 @@ if __name__ == "__main__":
         else:
             print("Treating every character from the image.")
         
+        if "-tile" in args:
+            try:
+                tile = int(args[args.index("-tile") + 1])
+            except (IndexError, ValueError):
+                print("The -tile flag needs to be followed by an integer value.\n")
+                exit(1)
+
+        if "-j" in args:
+            try:
+                workers = int(args[args.index("-j") + 1])
+            except (IndexError, ValueError):
+                print("The -j flag needs to be followed by an integer value.\n")
+                exit(1)
+
         if "-n" in args:
             try:
                 lsb = int(args[args.index("-n") + 1])
@@ -164,39 +446,32 @@ if __name__ == "__main__":
 
     # Get image
     inputFormats = (".png", ".tiff", ".bmp")
-    outputFormats = (".txt", ".msg", ".doc")
     inputFile = args[0]
     outputFile = args[1]
 
-    if not (inputFile[-4:] in inputFormats):
+    if inputFile != "-" and not inputFile.endswith(inputFormats):
         print("The format of the input file is not supported.")
         print("Please use .jpg, .png, .jpeg, .tiff, .bmp files as input.")
         exit(1)
 
-    if not (outputFile[-4:] in outputFormats):
-        print("The format of the output file is not supported.")
-        print("Please use .txt, .msg, .doc files as output.")
-        exit(1)
-    
-    # Get image
-    img, gray = getImage(inputFile)
-
-    # User information
-    print(f"The message will be read using the{f' {lsb}' if lsb > 1 else ''} least significant bit{'s' if lsb > 1 else ''} of each pixel.")
-    if not gray:
-        print(f"The message will be read using the {'' if nored else 'R'}{'' if nogreen else 'G'}{'' if noblue else 'B'} color channels of each pixel.")
+    # Use the standard input and output as buffers
+    if inputFile == "-":
+        inputFile = io.BytesIO(sys.stdin.buffer.read())
+    if outputFile == "-":
+        outputFile = sys.__stdout__
 
-    # Read data
-    bitsMessage = readMessage(img, nchars, lsb = lsb,
-                              nored=nored, nogreen=nogreen, noblue=noblue)
-
-    # Convert data to strings
-    message = toAlnum(bitsMessage)
-
-    # Save the obtained message to a text file
-    saveMessage(message, outputFile)
-    print(f"The obtained message was saved to {outputFile}.")
+    # Read the message, timing every stage
+    timer = Stats("-tracemalloc" in args, profilePath)
+    message = readFile(inputFile, outputFile, nchars, lsb, nored, nogreen, noblue, tile, workers,
+                       key = key, auto = auto, timer = timer)
 
     # Display the obtained message
-    print(f"\nObtained message:\n{message}")
+    if isinstance(outputFile, str):
+        if isinstance(message, bytes):
+            print(f"\nThe obtained message holds {len(message)} bytes of binary data.")
+        else:
+            print(f"\nObtained message:\n{message}")
 
+    timer.close()
+    if statsTarget:
+        saveStats(timer.record(), statsTarget)
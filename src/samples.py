@@ -0,0 +1,168 @@
+import hashlib
+import numpy as np
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Sample addressing shared by the steganography writing and reading tools.
+
+Samples are used in row-major order, or scattered over the image by a keyed
+permutation: a Feistel network over the sample numbers, walked again until it
+lands in the image, so that only the indices of the message are computed.
+
+Samples are processed by chunks on threads, and whole images on processes.
+"""
+
+# Rounds of the Feistel network
+ROUNDS = 6
+
+# Number of chunks reporting their progress
+STEPS = 100
+
+def getChannels(nored = False, nogreen = False, noblue = False):
+    """Returns the list of color channels to write to or read from."""
+
+    channels = []
+    if not nored:
+        channels.append(0)
+    if not nogreen:
+        channels.append(1)
+    if not noblue:
+        channels.append(2)
+
+    return channels
+
+def getLayout(shape, channels):
+    """Returns the depth of an image and the channels used in row-major order."""
+
+    # Grayscale images only have one sample per pixel
+    if len(shape) == 2:
+        return 1, [0]
+
+    # Ignore channels the image does not have
+    depth = shape[2]
+    return depth, [ch for ch in channels if ch < depth]
+
+def getCapacity(shape, channels, offset = 0):
+    """Returns the number of samples available after the offset pixel."""
+
+    depth, channels = getLayout(shape, channels)
+    px = shape[0] * shape[1]
+
+    return max(px - offset, 0) * len(channels)
+
+def getRoundKeys(key):
+    """Derives the round keys of the Feistel network from a text key."""
+
+    digest = hashlib.blake2b(str(key).encode(), digest_size=8 * ROUNDS).digest()
+    return np.frombuffer(digest, dtype=np.uint64)
+
+def permute(k, size, key):
+    """Maps sample numbers to their place in a keyed permutation of range(size)."""
+
+    # Halves of the smallest even bit width covering size
+    half = max(1, -(-(int(size) - 1).bit_length() // 2))
+    mask = np.uint64((1 << half) - 1)
+    keys = getRoundKeys(key)
+
+    def feistel(x):
+        left, right = x >> np.uint64(half), x & mask
+        for roundKey in keys:
+            # Mix the right half with the round key (splitmix64 finalizer)
+            f = (right ^ roundKey) * np.uint64(0x9E3779B97F4A7C15)
+            f ^= f >> np.uint64(29)
+            f *= np.uint64(0xBF58476D1CE4E5B9)
+            f ^= f >> np.uint64(32)
+            left, right = right, left ^ (f & mask)
+        return (left << np.uint64(half)) | right
+
+    # Walk again the numbers that land outside of the image
+    x = feistel(k.astype(np.uint64))
+    outside = np.flatnonzero(x >= size)
+    while len(outside):
+        x[outside] = feistel(x[outside])
+        outside = outside[x[outside] >= size]
+
+    return x.astype(np.int64)
+
+def getIndices(shape, count, channels, offset = 0, start = 0, key = None):
+    """Returns the flat indices of count samples after the offset pixel.
+
+    Samples are ordered row-major, then by channel in R, G, B order, skipping
+    the channels that are not used. The first index is the one of sample start.
+    With a key, the samples are scattered by a permutation of this order.
+    """
+
+    depth, channels = getLayout(shape, channels)
+
+    # Do not address more samples than the image holds
+    capacity = getCapacity(shape, channels, offset)
+    count = min(count, capacity - start)
+    if count <= 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # Pixel and channel of every sample
+    k = np.arange(start, start + count, dtype=np.int64)
+    if key is not None:
+        k = permute(k, capacity, key)
+    pixels = offset + k // len(channels)
+    chans = np.array(channels, dtype=np.int64)[k % len(channels)]
+
+    return pixels * depth + chans
+
+def runChunks(function, count, workers = 1, minimum = 1 << 16, progress = None):
+    """Calls function(start, stop) on contiguous chunks of count samples.
+
+    The chunks are processed by a pool of threads, numpy releasing the GIL
+    during its array operations. Every chunk holds a multiple of 8 samples
+    and at least minimum samples, so that small jobs run on a single thread.
+    With a progress callback, the samples are split in up to STEPS chunks and
+    progress(done, count) is called after every chunk: an exception it raises
+    cancels the chunks not started yet.
+    """
+
+    workers = max(1, min(workers, count // minimum))
+    size = -(-count // workers // 8) * 8 if count else 0
+    if progress is not None:
+        size = min(size, max(-(-count // STEPS // 8) * 8, minimum))
+    bounds = [(start, min(start + size, count)) for start in range(0, count, size or 1)]
+
+    if workers == 1:
+        for start, stop in bounds:
+            function(start, stop)
+            if progress is not None:
+                progress(stop, count)
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(function, start, stop): stop - start for start, stop in bounds}
+        done = 0
+        try:
+            for future in as_completed(futures):
+                future.result()
+                done += futures[future]
+                if progress is not None:
+                    progress(done, count)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+def runPool(function, items, workers = None, chunk = 0, initializer = None, initargs = ()):
+    """Calls function on every item on a pool of processes, yields the results
+    in order.
+
+    Items are sent to the processes by chunks of chunk items (a quarter of an
+    even share of the items by default).
+    """
+
+    workers = workers or os.cpu_count()
+
+    # Send several items at once to amortize the inter-process overhead
+    chunk = chunk or max(1, len(items) // (workers * 4))
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                             initargs=initargs) as executor:
+        yield from executor.map(function, items, chunksize=chunk)
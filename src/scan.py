@@ -0,0 +1,270 @@
+import functools
+import glob
+import json
+import math
+import os
+import sys
+import time
+import numpy as np
+from PIL import Image
+from header import CHANNELS
+from samples import getLayout, runPool
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Steganalysis tool.
+
+Scores how likely images are to hide data in their least significant bits,
+without knowing how it was written. Every channel is measured on its own:
+    chi-square attack: hiding random bits on the lsb least significant bits
+        evens out the counts of the values only differing by these bits. The
+        probability of that is computed on growing prefixes of the samples,
+        in the order write.py writes them, to estimate the written length.
+    RS analysis: flipping the least significant bit makes groups of samples
+        less smooth in natural images, and equally smooth or not in written
+        ones. The written fraction of the samples is estimated from the
+        regular and singular groups of the image and of its flipped copy.
+    bit-plane entropy: the entropy of the 2x2 patterns of a bit plane, which
+        is close to 1 when the plane is noise.
+"""
+
+# Names of the channels in the reports
+NAMES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+# Image files scanned in folders
+EXTENSIONS = (".png", ".bmp", ".tiff", ".tif", ".jpg", ".jpeg")
+
+def printDoc():
+    """Displays the documentation of the script and exits"""
+
+    print("""[steganographyScan.py]
+Ranks images by how likely they are to hide data in their least significant
+bits, with a pool of processes.
+
+Every channel is scored by a chi-square attack and the bit-plane entropy of
+its -n least significant bits, and by RS analysis of its least significant
+bit. The score of an image is the largest estimated written fraction of its
+channels (0 for clean images, 1 for images written whole).
+
+Flags:
+    -h: Displays this message and exits.
+    -n: The number of least significant bits to measure (1 by default).
+    -j: The number of worker processes (number of CPUs by default).
+    -chunk: The number of images sent to a worker at once.
+    -top: The number of images shown, the most suspicious first (20 by default).
+    -report: Saves the ranked measures of every image to a .jsonl file.
+
+The images are the files of a folder (and of its subfolders), or a glob pattern.
+
+Example:
+    python ./scan.py <folder> | -flags
+    python ./scan.py "<images/*.png>" | -flags
+""")
+    exit(0)
+
+def getFiles(target):
+    """Returns the images of a folder and its subfolders, or matching a pattern."""
+
+    if os.path.isdir(target):
+        return sorted(os.path.join(root, name) for root, _, names in os.walk(target)
+                      for name in names if name.lower().endswith(EXTENSIONS))
+
+    return sorted(glob.glob(target))
+
+def getTail(chi, df):
+    """Returns the probability of a chi-square value of df degrees of freedom
+    being exceeded (Wilson-Hilferty approximation)."""
+
+    if df <= 0:
+        return 0.0
+
+    z = ((chi / df) ** (1 / 3) - (1 - 2 / (9 * df))) / math.sqrt(2 / (9 * df))
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+def chiSquare(samples, lsb = 1, steps = 20):
+    """Returns the probability of the lsb least significant bits of growing
+    prefixes of samples (1 / steps of them, 2 / steps...) being random."""
+
+    # Histograms of every prefix
+    size = 1 << lsb
+    parts = np.minimum(np.arange(len(samples)) * steps // max(len(samples), 1), steps - 1)
+    counts = np.bincount(parts * 256 + samples, minlength = steps * 256).reshape(steps, -1, size)
+    counts = counts.cumsum(axis=0)
+
+    # Values only differing by their least significant bits are expected as
+    # often, categories expected too rarely being left out
+    expected = counts.mean(axis=2, keepdims=True)
+    valid = np.broadcast_to(expected > 4, counts.shape)
+    terms = np.where(valid, (counts - expected) ** 2 / np.maximum(expected, 1), 0)
+    chis = terms.sum(axis=(1, 2))
+    dfs = valid[:, :, 0].sum(axis=1) * (size - 1)
+
+    return np.array([getTail(chi, df) for chi, df in zip(chis, dfs)])
+
+def getLength(probabilities, threshold = 0.5):
+    """Returns the fraction of the samples written according to the chi-square
+    probabilities of their prefixes."""
+
+    written = np.flatnonzero(probabilities > threshold)
+    return 0.0 if not len(written) else (written[-1] + 1) / len(probabilities)
+
+def getSmoothness(x0, x1, x2, x3):
+    """Returns the variation of every group of 4 neighbouring samples."""
+    return np.abs(x1 - x0) + np.abs(x2 - x1) + np.abs(x3 - x2)
+
+def getRS(x0, x1, x2, x3):
+    """Returns the proportions of regular and singular groups, flipped by the
+    mask [0, 1, 1, 0] with the positive and the negative flipping."""
+
+    smoothness = getSmoothness(x0, x1, x2, x3)
+    positive = getSmoothness(x0, x1 ^ 1, x2 ^ 1, x3)
+    negative = getSmoothness(x0, ((x1 + 1) ^ 1) - 1, ((x2 + 1) ^ 1) - 1, x3)
+
+    size = len(smoothness)
+    return (np.count_nonzero(positive > smoothness) / size, np.count_nonzero(positive < smoothness) / size,
+            np.count_nonzero(negative > smoothness) / size, np.count_nonzero(negative < smoothness) / size)
+
+def rsAnalysis(plane):
+    """Returns the estimated fraction of the samples of a channel whose least
+    significant bit was written (Fridrich, Goljan and Du)."""
+
+    # Groups of 4 horizontal neighbours
+    width = plane.shape[1] - plane.shape[1] % 4
+    groups = np.ascontiguousarray(plane[:, :width].astype(np.int16).reshape(-1, 4).T)
+    if not groups.shape[1]:
+        return 0.0
+
+    # Measures of the image, and of the image with every bit flipped
+    rm, sm, rn, sn = getRS(*groups)
+    rmf, smf, rnf, snf = getRS(*(groups ^ 1))
+    d0, d1, n0, n1 = rm - sm, rmf - smf, rn - sn, rnf - snf
+
+    # Smallest root of 2 (d1 + d0) z**2 + (n0 - n1 - d1 - 3 d0) z + d0 - n0
+    a, b, c = 2 * (d1 + d0), n0 - n1 - d1 - 3 * d0, d0 - n0
+    if a == 0:
+        roots = [-c / b] if b else [0.0]
+    else:
+        delta = max(b * b - 4 * a * c, 0)
+        roots = [(-b + math.sqrt(delta)) / (2 * a), (-b - math.sqrt(delta)) / (2 * a)]
+    z = min(roots, key=abs)
+
+    return float(np.clip(z / (z - 0.5), 0, 1)) if z != 0.5 else 1.0
+
+def planeEntropy(plane, bit = 0):
+    """Returns the entropy of the 2x2 patterns of a bit plane, from 0 to 1."""
+
+    bits = (plane[:plane.shape[0] // 2 * 2, :plane.shape[1] // 2 * 2] >> bit) & 1
+    patterns = bits[0::2, 0::2] * 8 + bits[0::2, 1::2] * 4 + bits[1::2, 0::2] * 2 + bits[1::2, 1::2]
+    if not patterns.size:
+        return 0.0
+
+    p = np.bincount(patterns.reshape(-1), minlength=16) / patterns.size
+    p = p[p > 0]
+
+    return float(-(p * np.log2(p)).sum() / 4)
+
+def scanImage(filePath, lsb = 1):
+    """Measures every channel of an image, returns its record."""
+
+    start = time.perf_counter()
+    record = {"input": filePath}
+    try:
+        with Image.open(filePath) as img:
+            if img.mode not in ("L", "RGB", "RGBA"):
+                img = img.convert("RGB")
+            image = np.array(img)
+    except (OSError, ValueError) as e:
+        record.update(status="error", error=str(e), score=0.0, seconds=time.perf_counter() - start)
+        return record
+
+    # Measure the channels write.py writes to
+    depth, channels = getLayout(image.shape, CHANNELS)
+    image = image.reshape(image.shape[0], image.shape[1], depth)
+
+    record["channels"] = {}
+    for ch in channels:
+        plane = image[:, :, ch]
+        chi = [chiSquare(plane.reshape(-1), n) for n in range(1, lsb + 1)]
+        record["channels"][NAMES[depth][ch]] = {
+            "chi": [float(probabilities[-1]) for probabilities in chi],
+            "length": [getLength(probabilities) for probabilities in chi],
+            "rs": rsAnalysis(plane),
+            "entropy": [planeEntropy(plane, bit) for bit in range(lsb)]}
+
+    # The most written channel scores the image
+    record["score"] = max(max(measures["length"] + [measures["rs"]])
+                          for measures in record["channels"].values())
+    record["status"] = "ok"
+    record["seconds"] = time.perf_counter() - start
+
+    return record
+
+def scanFiles(paths, lsb = 1, workers = None, chunk = 0):
+    """Measures images on a pool of processes, yields their records in order."""
+    yield from runPool(functools.partial(scanImage, lsb = lsb), paths, workers, chunk)
+
+if __name__ == "__main__":
+    print("")
+
+    # Get arguments
+    args = sys.argv[1:]
+
+    # Show the documentation if needed
+    if "-h" in args or not len(args):
+        printDoc()
+
+    # Flags
+    lsb, workers, chunk, top, report = 1, None, 0, 20, None
+    try:
+        if "-n" in args:
+            lsb = int(args[args.index("-n") + 1])
+        if "-j" in args:
+            workers = int(args[args.index("-j") + 1])
+        if "-chunk" in args:
+            chunk = int(args[args.index("-chunk") + 1])
+        if "-top" in args:
+            top = int(args[args.index("-top") + 1])
+    except (IndexError, ValueError):
+        print("The -n, -j, -chunk and -top flags need to be followed by an integer value.\n")
+        exit(1)
+    if lsb < 1 or lsb > 8:
+        print("The amount of least significant bits to measure must be between 1 and 8.")
+        exit(1)
+    if "-report" in args:
+        if args.index("-report") + 1 >= len(args):
+            print("The -report flag needs to be followed by a file path.\n")
+            exit(1)
+        report = args[args.index("-report") + 1]
+
+    # Get the images to scan
+    paths = getFiles(args[0])
+    if not paths:
+        print(f"No image was found in {args[0]}. Exiting...")
+        exit(1)
+    print(f"{len(paths)} images will be scanned by {workers or os.cpu_count()} processes.")
+
+    # Scan the images, the most suspicious first
+    start = time.perf_counter()
+    records = sorted(scanFiles(paths, lsb, workers, chunk), key=lambda record: -record["score"])
+    elapsed = time.perf_counter() - start
+
+    for record in [record for record in records if record["status"] == "ok"][:top]:
+        measures = " ".join(f"{name}: rs {values['rs']:.2f} chi {values['length'][0]:.2f} entropy {values['entropy'][0]:.3f}"
+                            for name, values in record["channels"].items())
+        print(f"[{record['score']:.2f}] {record['input']} ({measures})")
+
+    for record in records:
+        if record["status"] != "ok":
+            print(f"[error] {record['input']}: {record['error']}")
+
+    # Save the measures of every image
+    if report:
+        with open(report, 'w') as file:
+            file.writelines(json.dumps(record) + "\n" for record in records)
+        print(f"The report is saved as {report}.")
+
+    # Throughput
+    errors = sum(record["status"] != "ok" for record in records)
+    print(f"{len(records) - errors} images were scanned in {elapsed:.2f}s "
+          f"({len(records) / elapsed * 3600:.0f} images per hour), {errors} failed.")
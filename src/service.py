@@ -0,0 +1,260 @@
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+from PIL import Image
+from cache import getCache, setCache
+from codec import StegoCodec
+from tiles import getShape
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Steganography HTTP service.
+
+Serves the writing and reading tools on localhost, so that the numpy and PIL
+imports and the worker processes are shared by every request. Endpoints:
+    POST /embed?image=<size>: The body holds the encoded image (its first size
+        bytes) followed by the payload. Returns the image as .png.
+    POST /extract: The body holds the encoded image. Returns the payload.
+    POST /capacity: The body holds the encoded image, or is empty and the
+        width, height and bands query parameters give its shape. Returns the
+        number of payload bytes it can hold as JSON.
+
+Query parameters: n, nored, nogreen, noblue, raw, compress, level, key, fec
+(as the write.py flags), l (as the read.py flag) and text (the payload is ASCII
+text).
+
+Example:
+    curl --data-binary @<image.png> "http://127.0.0.1:8080/extract" -o <payload>
+"""
+
+HOST = "127.0.0.1"
+
+# Reasons of the status codes sent
+REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+def printDoc():
+    """Displays the documentation of the script and exits"""
+
+    print("""[steganographyService.py]
+Serves the writing and reading tools as an HTTP API on localhost.
+
+Flags:
+    -h: Displays this message and exits.
+    -port: The port to listen on (8080 by default).
+    -j: The number of worker processes (number of CPUs by default).
+    -queue: The number of requests waiting for a worker before new ones are
+            rejected with a 503 status (4 per worker by default).
+    -maxsize: The maximum size of a request body in MB (64 by default).
+    -cache: The memory budget in MB of the decoded images kept by every
+            worker, so that repeated requests on one image decode it once
+            (0 by default).
+
+Example:
+    python ./service.py -port 8080 | -flags
+""")
+    exit(0)
+
+# Codecs of the configurations already seen by a worker process, which share
+# its cache of decoded images
+codecs = {}
+
+def getCodec(options):
+    """Returns the codec of a configuration, built once per worker process."""
+
+    key = tuple(sorted(options.items()))
+    if key not in codecs:
+        codecs[key] = StegoCodec(**options, cache = getCache())
+
+    return codecs[key]
+
+def embedJob(image, payload, options):
+    """Hides a payload in encoded image bytes, returns the .png result."""
+    return getCodec(options).embed(image, payload)
+
+def extractJob(image, nchars, options):
+    """Reads the payload hidden in encoded image bytes."""
+    return getCodec(options).extract(image, nchars)
+
+def getOptions(query):
+    """Converts query parameters to codec options."""
+
+    flags = {key: query.get(key, "0") not in ("0", "false", "")
+             for key in ("nored", "nogreen", "noblue", "raw", "fec")}
+    options = {"lsb": int(query.get("n", 1)), "nored": flags["nored"], "nogreen": flags["nogreen"],
+               "noblue": flags["noblue"], "header": not flags["raw"],
+               "compression": query.get("compress") or None, "key": query.get("key"),
+               "correction": flags["fec"]}
+    if "level" in query:
+        options["level"] = int(query["level"])
+
+    # Check the options before sending them to a worker
+    StegoCodec(**options)
+
+    return options
+
+def getImageCapacity(body, query, options):
+    """Returns the capacity of an image, from its encoded bytes or its shape."""
+
+    if body:
+        with Image.open(io.BytesIO(body)) as img:
+            shape = getShape(img)
+    else:
+        height, width, bands = int(query["height"]), int(query["width"]), int(query.get("bands", 3))
+        shape = (height, width) if bands == 1 else (height, width, bands)
+
+    return StegoCodec(**options).capacity(shape)
+
+class Service:
+    """HTTP server sending the requests to a bounded pool of processes."""
+
+    def __init__(self, workers = None, queue = None, maxsize = 64, budget = 0):
+        """Creates the pool of processes, caching budget bytes of images each."""
+
+        self.workers = workers or os.cpu_count()
+        self.queue = self.workers * 4 if queue is None else queue
+        self.maxsize = int(maxsize * 1e6)
+
+        # Requests running on a worker, and waiting for one
+        self.slots = asyncio.Semaphore(self.workers)
+        self.pending = 0
+
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=setCache,
+                                            initargs=(budget,))
+
+    async def run(self, function, *args):
+        """Runs a job on a worker, waiting for a free one."""
+
+        self.pending += 1
+        try:
+            async with self.slots:
+                return await asyncio.get_running_loop().run_in_executor(self.executor, function, *args)
+        finally:
+            self.pending -= 1
+
+    async def respond(self, writer, status, body = b"", contentType = "application/octet-stream"):
+        """Sends a response and closes the connection."""
+
+        if isinstance(body, str):
+            body, contentType = body.encode(), "text/plain; charset=utf-8"
+        head = (f"HTTP/1.1 {status} {REASONS[status]}\r\nContent-Type: {contentType}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n")
+        if status == 503:
+            head += "Retry-After: 1\r\n"
+        writer.write(head.encode() + b"\r\n" + body)
+        await writer.drain()
+        writer.close()
+
+    async def handle(self, reader, writer):
+        """Reads a request and dispatches it to its endpoint."""
+
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+            writer.close()
+            return
+
+        lines = head.decode("latin-1").split("\r\n")
+        try:
+            method, target, _ = lines[0].split(" ", 2)
+        except ValueError:
+            return await self.respond(writer, 400, "The request line is malformed.\n")
+        headers = dict(line.lower().split(": ", 1) for line in lines[1:] if ": " in line)
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+
+        if url.path not in ("/embed", "/extract", "/capacity"):
+            return await self.respond(writer, 404, f"Unknown endpoint {url.path}.\n")
+        if method != "POST":
+            return await self.respond(writer, 405, "Only POST requests are served.\n")
+
+        # Reject the requests that would exceed the limits before reading them
+        try:
+            length = int(headers.get("content-length", 0))
+        except ValueError:
+            length = -1
+        if length < 0:
+            return await self.respond(writer, 400, "The Content-Length header is malformed.\n")
+        if length > self.maxsize:
+            return await self.respond(writer, 413, f"The body exceeds {self.maxsize} bytes.\n")
+        if url.path != "/capacity" and self.pending >= self.workers + self.queue:
+            return await self.respond(writer, 503, "Too many requests are waiting for a worker.\n")
+
+        try:
+            body = await reader.readexactly(length)
+        except asyncio.IncompleteReadError:
+            writer.close()
+            return
+
+        try:
+            options = getOptions(query)
+            if url.path == "/capacity":
+                capacity = getImageCapacity(body, query, options)
+                return await self.respond(writer, 200, json.dumps({"bytes": capacity}).encode(),
+                                          "application/json")
+
+            if url.path == "/embed":
+                size = int(query.get("image", length))
+                image, payload = body[:size], body[size:]
+                if query.get("text", "0") not in ("0", "false", ""):
+                    payload = payload.decode("latin-1")
+                result = await self.run(embedJob, image, payload, options)
+                return await self.respond(writer, 200, result, "image/png")
+
+            result = await self.run(extractJob, body, int(query.get("l", 0)), options)
+            return await self.respond(writer, 200, result)
+        except (KeyError, ValueError, OSError) as e:
+            return await self.respond(writer, 400, f"{e}\n")
+        except Exception as e:
+            return await self.respond(writer, 500, f"The request failed ({type(e).__name__}: {e}).\n")
+
+    async def serve(self, port = 8080):
+        """Serves requests on localhost until cancelled."""
+
+        server = await asyncio.start_server(self.handle, HOST, port)
+        print(f"Serving on http://{HOST}:{port} with {self.workers} processes.")
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.executor.shutdown(cancel_futures=True)
+
+if __name__ == "__main__":
+    print("")
+
+    # Get arguments
+    args = sys.argv[1:]
+
+    # Show the documentation if needed
+    if "-h" in args:
+        printDoc()
+
+    # Flags
+    port, workers, queue, maxsize, budget = 8080, None, None, 64, 0
+
+    # Update flags
+    try:
+        if "-port" in args:
+            port = int(args[args.index("-port") + 1])
+        if "-j" in args:
+            workers = int(args[args.index("-j") + 1])
+        if "-queue" in args:
+            queue = int(args[args.index("-queue") + 1])
+        if "-maxsize" in args:
+            maxsize = float(args[args.index("-maxsize") + 1])
+        if "-cache" in args:
+            budget = float(args[args.index("-cache") + 1]) * 1e6
+    except (IndexError, ValueError):
+        print("The -port, -j, -queue, -maxsize and -cache flags need to be followed by a number.\n")
+        exit(1)
+
+    try:
+        asyncio.run(Service(workers, queue, maxsize, budget).serve(port))
+    except KeyboardInterrupt:
+        print("The service was stopped.")
@@ -0,0 +1,275 @@
+import glob
+import os
+import struct
+import sys
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+from codec import StegoCodec
+from header import COMPRESSIONS, LEVELS, compress, decompress
+from tiles import getShape
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Steganography sharding tool.
+"""
+
+# Shard fields, written in front of every chunk: magic, compression flags,
+# identifier of the payload (its checksum), index, count, payload length
+SHARD_MAGIC = b"SH"
+SHARD_FORMAT = ">2sBIHHI"
+SHARD_SIZE = struct.calcsize(SHARD_FORMAT)
+
+def printDoc():
+    """Displays the documentation of the script and exits"""
+
+    print("""[steganographyShard.py]
+Hides a payload too large for one image across several images, or across
+the frames of a multi-frame .tiff file, and reassembles it.
+
+The payload is split in chunks sized to the capacity of every carrier, in
+order. Every chunk is written with its index and the checksum of the whole
+payload, so that the chunks can be read in any order.
+
+Flags:
+    -h: Displays this message and exits.
+    -nored, -nogreen, -noblue, -n, -key, -fec, -matrix: Same as the write.py
+        flags, applied to every carrier (the reader only needs -key).
+    -compress, -level: Compresses the whole payload before splitting it.
+    -j: The number of worker processes (number of CPUs by default).
+
+The input images are a glob pattern, or a single .tiff file whose frames are
+the carriers. Images are written to the output folder with their names as
+.png files (lossy formats would destroy the shards), and frames to the output
+.tiff file.
+
+Example:
+    python ./shard.py write <payload.bin> "<images/*.png>" <outputFolder> | -flags
+    python ./shard.py write <payload.bin> <frames.tiff> <output.tiff> | -flags
+    python ./shard.py read "<outputFolder/*.png>" <payload.bin> | -flags
+""")
+    exit(0)
+
+def getCarriers(pattern):
+    """Returns the (image path, frame) carriers matching a pattern, and whether
+    they are the frames of one .tiff file."""
+
+    paths = sorted(glob.glob(pattern))
+    if len(paths) == 1 and paths[0].lower().endswith((".tif", ".tiff")):
+        with Image.open(paths[0]) as img:
+            frames = getattr(img, "n_frames", 1)
+        if frames > 1:
+            return [(paths[0], frame) for frame in range(frames)], True
+
+    return [(path, 0) for path in paths], False
+
+def getFrame(path, frame = 0):
+    """Decodes one frame of an image file to a numpy array."""
+
+    with Image.open(path) as img:
+        img.seek(frame)
+        return np.array(img)
+
+def getFrameShape(path, frame = 0):
+    """Returns the shape of one frame of an image file, without decoding it."""
+
+    with Image.open(path) as img:
+        img.seek(frame)
+        return getShape(img)
+
+def splitPayload(data, capacities, flags = 0):
+    """Splits a payload in shards fitting the capacities, returns them, or None
+    if the carriers are too small."""
+
+    identifier = zlib.crc32(data)
+    sizes = [max(capacity - SHARD_SIZE, 0) for capacity in capacities]
+    if sum(sizes) < len(data):
+        return None
+
+    # Only use the carriers needed, in order
+    chunks, start = [], 0
+    for size in sizes:
+        if start >= len(data) and chunks:
+            break
+        chunks.append(data[start:start + size])
+        start += size
+
+    return [struct.pack(SHARD_FORMAT, SHARD_MAGIC, flags, identifier, index, len(chunks), len(data)) + chunk
+            for index, chunk in enumerate(chunks)]
+
+def joinShards(shards):
+    """Reassembles a payload from its shards, in any order.
+
+    Shards of other payloads are ignored, the payload with the most shards
+    being kept. Returns the payload, or raises a ValueError naming the
+    missing shards.
+    """
+
+    # Shards of every payload, by index
+    payloads = {}
+    for shard in shards:
+        magic, flags, identifier, index, count, length = struct.unpack(SHARD_FORMAT, shard[:SHARD_SIZE])
+        payloads.setdefault((identifier, flags, count, length), {})[index] = shard[SHARD_SIZE:]
+
+    if not payloads:
+        raise ValueError("No shard was found.")
+
+    (identifier, flags, count, length), chunks = max(payloads.items(), key=lambda item: len(item[1]))
+    missing = [index for index in range(count) if index not in chunks]
+    if missing:
+        raise ValueError(f"The shards {missing} of {count} are missing.")
+
+    data = b"".join(chunks[index] for index in range(count))
+    if len(data) != length or zlib.crc32(data) != identifier:
+        raise ValueError("The reassembled payload does not match its checksum.")
+
+    return decompress(data, flags)
+
+def writeShard(path, frame, output, shard, options):
+    """Hides a shard in a carrier, saves it or returns it if output is None."""
+
+    image = StegoCodec(**options).embed(getFrame(path, frame), shard, inplace = True)
+    if output is None:
+        return image
+
+    Image.fromarray(image).save(output)
+
+def readShard(path, frame, options):
+    """Reads the shard hidden in a carrier, returns None if it holds none."""
+
+    try:
+        data = StegoCodec(**options).extract(getFrame(path, frame))
+    except ValueError:
+        return None
+
+    if len(data) < SHARD_SIZE or data[:len(SHARD_MAGIC)] != SHARD_MAGIC:
+        return None
+
+    return data
+
+if __name__ == "__main__":
+    print("")
+
+    # Get arguments
+    args = sys.argv[1:]
+
+    # Show the documentation if needed
+    if "-h" in args or len(args) < 3 or args[0] not in ("write", "read"):
+        printDoc()
+    mode = args[0]
+
+    # Flags
+    options = {"lsb": 1, "nored": "-nored" in args, "nogreen": "-nogreen" in args,
+               "noblue": "-noblue" in args, "correction": "-fec" in args}
+    workers, compression, level = None, None, None
+    try:
+        if "-n" in args:
+            options["lsb"] = int(args[args.index("-n") + 1])
+        if "-matrix" in args:
+            options["matrix"] = int(args[args.index("-matrix") + 1])
+        if "-j" in args:
+            workers = int(args[args.index("-j") + 1])
+        if "-level" in args:
+            level = int(args[args.index("-level") + 1])
+        if "-key" in args:
+            options["key"] = args[args.index("-key") + 1]
+        if "-compress" in args:
+            compression = args[args.index("-compress") + 1]
+    except (IndexError, ValueError):
+        print("The -n, -matrix, -j and -level flags need to be followed by an integer value, "
+              "-key and -compress by a value.\n")
+        exit(1)
+    if compression not in COMPRESSIONS:
+        print("The -compress flag needs to be followed by zlib, bz2 or lzma.\n")
+        exit(1)
+    if compression and level is not None and not LEVELS[compression][0] <= level <= LEVELS[compression][1]:
+        print(f"The {compression} compression level must be between {LEVELS[compression][0]} and {LEVELS[compression][1]}.\n")
+        exit(1)
+    try:
+        StegoCodec(**options)
+    except ValueError as e:
+        print(f"{e}\n")
+        exit(1)
+
+    if mode == "write":
+        if len(args) < 4:
+            printDoc()
+        payloadFile, pattern, output = args[1], args[2], args[3]
+
+        # Get the payload and the carriers
+        try:
+            data = open(payloadFile, 'rb').read()
+        except OSError:
+            print("The payload file could not be read. Exiting...")
+            exit(1)
+        carriers, frames = getCarriers(pattern)
+        if not carriers:
+            print(f"No image matches {pattern}. Exiting...")
+            exit(1)
+
+        data, flags = compress(data, compression, level)
+        capacities = [StegoCodec(**options).capacity(getFrameShape(path, frame)) for path, frame in carriers]
+        shards = splitPayload(data, capacities, flags)
+        if shards is None:
+            print(f"The payload ({len(data)} bytes) does not fit into the {len(carriers)} carriers "
+                  f"({sum(max(c - SHARD_SIZE, 0) for c in capacities)} bytes). Exiting...")
+            exit(1)
+
+        # User information
+        print(f"The payload ({len(data)} bytes) is split in {len(shards)} shards "
+              f"over {len(carriers)} {'frames' if frames else 'images'}.")
+
+        # Outputs of every carrier, in lossless formats (frames are returned to
+        # be saved together)
+        if frames:
+            if not output.lower().endswith((".tif", ".tiff")):
+                print("The frames of a .tiff file must be saved to a .tiff file. Exiting...")
+                exit(1)
+            outputs = [None] * len(shards)
+        else:
+            outputs = [os.path.join(output, os.path.splitext(os.path.basename(path))[0] + ".png")
+                       for path, _ in carriers[:len(shards)]]
+
+            # Carriers sharing a name would overwrite each other's shard
+            duplicates = sorted({path for path in outputs if outputs.count(path) > 1})
+            if duplicates:
+                print(f"Several carriers would be saved as {', '.join(duplicates)}. Please rename them. Exiting...")
+                exit(1)
+            os.makedirs(output, exist_ok=True)
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            images = list(executor.map(writeShard, [path for path, _ in carriers[:len(shards)]],
+                                       [frame for _, frame in carriers[:len(shards)]], outputs,
+                                       shards, [options] * len(shards)))
+
+        # Save every frame, unused frames being copied as is
+        if frames:
+            images += [getFrame(path, frame) for path, frame in carriers[len(shards):]]
+            images = [Image.fromarray(image) for image in images]
+            images[0].save(output, save_all=True, append_images=images[1:])
+
+        print(f"The shards are saved to {output}.")
+
+    else:
+        pattern, output = args[1], args[2]
+        carriers, frames = getCarriers(pattern)
+        if not carriers:
+            print(f"No image matches {pattern}. Exiting...")
+            exit(1)
+
+        # Read the shards of every carrier, in any order
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            shards = [shard for shard in executor.map(readShard, [path for path, _ in carriers],
+                                                      [frame for _, frame in carriers],
+                                                      [options] * len(carriers)) if shard]
+
+        try:
+            data = joinShards(shards)
+        except ValueError as e:
+            print(f"{e} Exiting...")
+            exit(1)
+
+        open(output, 'wb').write(data)
+        print(f"The payload ({len(data)} bytes) was reassembled from {len(shards)} shards and saved to {output}.")
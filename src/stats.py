@@ -0,0 +1,114 @@
+import contextlib
+import cProfile
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Instrumentation of the steganography tools.
+
+A Stats object times the stages of an operation (decoding, embedding,
+encoding...), optionally samples their peak memory allocation with
+tracemalloc, and profiles them with cProfile. Its record is a JSON compatible dict, which the tools print or
+save with the -stats flag, and which batch jobs sum over many images.
+
+Example:
+    timer = Stats()
+    with timer.stage("decode"):
+        img, px = getImage(inputFile)
+    print(timer.record())
+"""
+
+# Unit of ru_maxrss: bytes on macOS, kilobytes on the other systems
+RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+def getRSS():
+    """Returns the peak resident memory of the process in MB, None if unknown."""
+
+    if not resource:
+        return None
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT / 1e6
+
+class Stats:
+    """Timer and memory sampler of the stages of an operation."""
+
+    def __init__(self, memory = False, profile = None):
+        """Creates an empty record, tracing allocations if memory is set, and
+        profiling with cProfile until close if profile is a file path."""
+
+        self.memory = memory
+        self.seconds = {}
+        self.peaks = {}
+
+        self.profile = profile
+        self.profiler = None
+        if profile:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Times the code run in the context, adding it to the stage name."""
+
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0) + time.perf_counter() - start
+            if self.memory:
+                self.peaks[name] = max(self.peaks.get(name, 0), tracemalloc.get_traced_memory()[1] / 1e6)
+
+    def record(self):
+        """Returns the time of every stage, and their peak memory if sampled."""
+
+        record = {"stages": dict(self.seconds), "total_seconds": sum(self.seconds.values())}
+        if self.memory:
+            record["peak_mb"] = dict(self.peaks)
+        rss = getRSS()
+        if rss is not None:
+            record["rss_mb"] = rss
+
+        return record
+
+    def close(self):
+        """Stops profiling, and saves the profile (readable by pstats)."""
+
+        if self.profiler:
+            self.profiler.disable()
+            self.profiler.dump_stats(self.profile)
+            self.profiler = None
+            print(f"The profile is saved as {self.profile}.")
+
+def aggregate(records):
+    """Sums the stage times of several records."""
+
+    stages = {}
+    for record in records:
+        for name, seconds in record.get("stages", {}).items():
+            stages[name] = stages.get(name, 0) + seconds
+
+    return {"stages": stages, "total_seconds": sum(stages.values()), "count": len(records)}
+
+def saveStats(record, target):
+    """Prints a record as a JSON line (target json), or saves it to a file."""
+
+    if target == "json":
+        print(json.dumps(record))
+    else:
+        with open(target, 'w') as file:
+            json.dump(record, file, indent=1)
+        print(f"The statistics are saved as {target}.")
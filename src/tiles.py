@@ -0,0 +1,205 @@
+import numpy as np
+import os
+import shutil
+from PIL import Image
+
+"""
+Valérian Grégoire--Bégranger - 2024
+
+Tiled access to images too large to be decoded twice in memory.
+
+A TiledImage exposes the shape, take and put interface of a numpy array on
+flattened sample indices, so that the writing and reading functions can use
+it in place of an array. Samples are accessed by strips of rows, and only the
+strips holding the requested samples are read or written.
+
+Uncompressed BMP and TIFF files are memory-mapped: only the pages of the
+strips holding the message are touched. Other formats are decoded once by
+PIL, without any numpy copy of the whole image.
+"""
+
+# Raw modes that can be mapped: depth of the stored pixels, and selection of
+# the channels in R, G, B(, A) order
+RAWMODES = {
+    "L": (1, None),
+    "RGB": (3, slice(None)),
+    "RGBA": (4, slice(None)),
+    "BGR": (3, slice(None, None, -1)),
+    "BGRX": (4, slice(2, None, -1)),
+}
+
+def getShape(img):
+    """Returns the shape numpy gives to a PIL image."""
+
+    width, height = img.size
+    bands = len(img.getbands())
+
+    return (height, width) if bands == 1 else (height, width, bands)
+
+def mapTiles(filePath, mode = "r"):
+    """Memory-maps the pixels of an uncompressed image.
+
+    Returns a list of (first row, last row, array view, memory map) tuples, or
+    None when the pixels are not stored raw.
+    """
+
+    with Image.open(filePath) as img:
+        tiles, (width, height) = img.tile, img.size
+
+    views = []
+    for tile in tiles:
+        name, (x0, y0, x1, y1), offset, args = tile
+        if name != "raw" or (x0, x1) != (0, width) or args[0] not in RAWMODES:
+            return None
+
+        rawmode, stride, direction = args[0], args[1], args[2] if len(args) > 2 else 1
+        depth, select = RAWMODES[rawmode]
+        stride = stride or width * depth
+        rows = y1 - y0
+
+        # Rows as stored in the file
+        data = np.memmap(filePath, dtype=np.uint8, mode=mode, offset=offset, shape=(rows * stride,))
+        view = data.reshape(rows, stride)[:, :width * depth]
+
+        # Rows and channels in the order numpy gives them
+        if select is None:
+            view = view.reshape(rows, width)
+        else:
+            view = view.reshape(rows, width, depth)[:, :, select]
+        if direction < 0:
+            view = view[::-1]
+
+        views.append((y0, y1, view, data))
+
+    return sorted(views, key = lambda tile: tile[0])
+
+class TiledImage:
+    """Image whose samples are accessed by strips of rows."""
+
+    def __init__(self, filePath, rows = 256, mode = "r", gray = False):
+        """Opens an image, memory-mapped in mode if possible and not converted
+        (decoded by PIL if mode is None)."""
+
+        self.rows = rows
+        self.image = None
+        self.written = 0
+        mapped = mode is not None and not gray and isinstance(filePath, str)
+        self.tiles = mapTiles(filePath, mode) if mapped else None
+
+        # Fall back to a single PIL decoding of the image
+        if self.tiles is None:
+            self.image = Image.open(filePath)
+            if gray:
+                self.image = self.image.convert("L")
+            self.image.load()
+            self.shape = getShape(self.image)
+        else:
+            self.shape = (self.tiles[-1][1],) + self.tiles[0][2].shape[1:]
+
+        self.rowSize = int(np.prod(self.shape[1:]))
+
+    @classmethod
+    def copy(cls, inputFile, outputFile, rows = 256, gray = False):
+        """Opens an image to write to, patching a copy of the file if possible."""
+
+        # Only raw files kept in the same format can be patched
+        paths = isinstance(inputFile, str) and isinstance(outputFile, str)
+        sameFormat = paths and os.path.splitext(inputFile)[1].lower() == os.path.splitext(outputFile)[1].lower()
+        if not gray and sameFormat and mapTiles(inputFile) is not None:
+            if os.path.abspath(inputFile) != os.path.abspath(outputFile):
+                shutil.copyfile(inputFile, outputFile)
+            return cls(outputFile, rows, "r+")
+
+        # Other files are decoded, as the input must not be written to and the
+        # output is encoded by save
+        return cls(inputFile, rows, None, gray)
+
+    def strips(self):
+        """Yields the first and last rows of every strip."""
+
+        if self.tiles is None:
+            bounds = [(0, self.shape[0])]
+        else:
+            bounds = [(y0, y1) for y0, y1, _, _ in self.tiles]
+
+        for y0, y1 in bounds:
+            for row in range(y0, y1, self.rows):
+                yield row, min(row + self.rows, y1)
+
+    def readStrip(self, first, last):
+        """Returns a copy of the samples of rows first to last."""
+
+        if self.tiles is None:
+            return np.array(self.image.crop((0, first, self.shape[1], last)))
+
+        for y0, y1, view, _ in self.tiles:
+            if y0 <= first < y1:
+                return np.array(view[first - y0:last - y0])
+
+    def writeStrip(self, first, last, strip):
+        """Writes the samples of rows first to last."""
+
+        if self.tiles is None:
+            size = (self.shape[1], last - first)
+            self.image.paste(Image.frombytes(self.image.mode, size, strip.tobytes()), (0, first))
+            return
+
+        for y0, y1, view, _ in self.tiles:
+            if y0 <= first < y1:
+                view[first - y0:last - y0] = strip
+                return
+
+    def groups(self, indices):
+        """Yields the strips holding samples, with the positions of these samples."""
+
+        order = np.argsort(indices, kind="stable")
+        ordered = indices[order]
+
+        for first, last in self.strips():
+            lo, hi = np.searchsorted(ordered, [first * self.rowSize, last * self.rowSize])
+            if lo < hi:
+                yield first, last, order[lo:hi], ordered[lo:hi] - first * self.rowSize
+
+            # No sample after this strip
+            if hi == len(ordered):
+                return
+
+    def take(self, indices):
+        """Returns the samples at flat indices."""
+
+        indices = np.asarray(indices, dtype=np.int64)
+        values = np.zeros(len(indices), dtype=np.uint8)
+        for first, last, positions, local in self.groups(indices):
+            values[positions] = self.readStrip(first, last).reshape(-1)[local]
+
+        return values
+
+    def put(self, indices, values):
+        """Writes samples at flat indices."""
+
+        indices = np.asarray(indices, dtype=np.int64)
+        values = np.asarray(values, dtype=np.uint8)
+        self.written += len(indices)
+        for first, last, positions, local in self.groups(indices):
+            if self.tiles is None:
+                strip = self.readStrip(first, last)
+                strip.reshape(-1)[local] = values[positions]
+                self.writeStrip(first, last, strip)
+                continue
+
+            # Write the samples straight to the mapped file, so that only their
+            # pages are modified
+            for y0, y1, view, _ in self.tiles:
+                if y0 <= first < y1:
+                    position = np.unravel_index(local, (last - first,) + view.shape[1:])
+                    view[(position[0] + first - y0,) + position[1:]] = values[positions]
+                    break
+
+    def save(self, filePath):
+        """Saves the image, memory-mapped files are already up to date."""
+
+        if self.tiles is None:
+            self.image.save(filePath, format=None if isinstance(filePath, str) else "PNG")
+        else:
+            for _, _, _, data in self.tiles:
+                data.flush()
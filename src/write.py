@@ -1,6 +1,16 @@
+import io
 import numpy as np
+import os
 import sys
-from PIL import Image
+import time
+from PIL import Image, PngImagePlugin
+from tiles import TiledImage
+import fec
+from header import CHANNELS, COMPRESSION_MASK, COMPRESSION_SHIFT, COMPRESSIONS, FLAG_BINARY, FLAG_FEC, FLAG_SCATTER, LEVELS, MATRIX_MASK, MATRIX_SHIFT, compress, getOffset, packHeader
+from read import readHeader, readPayload
+from samples import getCapacity, getChannels, getIndices, runChunks
+from quality import choosePlan, getMSE, getPlans, getSSIM, toPSNR
+from stats import Stats, saveStats
 
 """
 Valérian Grégoire--Bégranger - 2024
@@ -8,6 +18,11 @@ Valérian Grégoire--Bégranger - 2024
 Steganography writing tool.
 """
 
+# Lossless output formats, and compressions of .tiff outputs, the only ones
+# keeping the message
+OUTPUT_FORMATS = (".png", ".tiff", ".bmp")
+TIFF_COMPRESSIONS = ("raw", "packbits", "tiff_lzw", "tiff_adobe_deflate")
+
 def printDoc():
     """Displays the documentation of the script and exits"""
 
@@ -17,14 +32,58 @@ Hides text in an image.
 Flags:
     -h: Displays this message and exits.
     -gray: Converts the image to grayscale.
-    -nored: The R channel in RGB will remain untouched.
-    -nogreen: The G channel in RGB will remain untouched.
-    -noblue: The B channel in RGB will remain untouched.
+    -nored: The message will not be written on the R channel in RGB.
+    -nogreen: The message will not be written on the G channel in RGB.
+    -noblue: The message will not be written on the B channel in RGB.
     -n: The number of LSB the message will be written on.
-    -fromfile: Uses text from a file.
+    -fromfile: Uses the bytes of a file (- for the standard input), which
+               read.py saves as is.
+    -j: The number of threads writing the image (1 by default).
+    -tile: Processes the image by strips of the given number of rows, without
+           copying it in memory (uncompressed .bmp/.tiff files written to
+           the same format are patched in place).
+    -raw: Does not write the header describing the message (read.py will
+          then need the -l, -n and channel flags).
+    -compress: Compresses the message with zlib, bz2 or lzma before writing
+               it (read.py decompresses it automatically).
+    -level: The compression level (0-9).
+    -fec: Protects the message with error correcting codes, which double its
+          size and let read.py correct one flipped bit in every half byte.
+    -key: Scatters the message over the image with a permutation of the
+          samples derived from the given text (read.py needs the same key).
+    -matrix: Writes k bits on every block of 2**k - 1 samples by changing at
+             most one least significant bit (k between 1 and 7), instead of
+             writing on -n bits of every sample.
+    -pnglevel: The zlib level of .png outputs, from 0 (fastest, largest) to
+               9 (slowest, smallest), 6 by default.
+    -tiffcompression: The compression of .tiff outputs (raw, packbits,
+                      tiff_lzw, tiff_adobe_deflate), raw by default.
+    -keepmeta: Saves the result with the metadata of the input image (dpi,
+               color profile, exif, text), and the compression of .tiff inputs.
+    -stats: Prints the time spent in every stage as a JSON line (-stats json),
+            or saves it to a .json file.
+    -tracemalloc: Adds the peak memory allocation of every stage to -stats.
+    -profile: Saves a cProfile profile of the run to a file.
+    -update: Replaces the message hidden in an uncompressed .bmp/.tiff file
+             in place (no output path), with the parameters it was written
+             with. Only the samples whose bits change are written.
+    -plan: Chooses the -n and channel flags writing the message with the
+           lowest predicted distortion, instead of using the given ones.
+    -psnr: The minimum PSNR in dB allowed by -plan.
+    -mse: The maximum mean square error allowed by -plan.
+    -ssim: Also displays the structural similarity of the result, which is
+           slow on large images.
+
+The header is written on every channel of the first pixels of the image, so
+the channels left out by -nored, -nogreen and -noblue are only untouched with
+-raw.
+
+The input and output paths can be - to use the standard input and output
+(the output is then written as .png and the messages are sent to stderr).
 
 Example:
     python ./write.py <imagePath.png> <outputPath.png> | -flags
+    python ./write.py <imagePath.bmp> -update -fromfile <message.txt> | -flags
 """)
     exit(0)
 
@@ -48,9 +107,17 @@ def getMessage(limit):
         print("")
         return choice
 
+def toBytes(message):
+    """Converts ASCII compliant text to bytes, bytes are kept as is."""
+
+    if isinstance(message, str):
+        return message.encode("latin-1", errors="replace")
+
+    return message
+
 def toBinary(message):
-    """Converts ASCII compliant text to a binary string."""
-    return "".join( ["{:08d}".format( int(bin(ord(chr))[2:]) ) for chr in message] )
+    """Converts bytes, or ASCII compliant text, to an array of bits."""
+    return np.unpackbits(np.frombuffer(toBytes(message), dtype=np.uint8))
 
 def getImage(filePath, gray = False):
     """Imports and converts an image file to a numpy array."""
@@ -75,82 +142,202 @@ def getImage(filePath, gray = False):
     return img, px
 
 def setLSB(x, y, n):
-    """Replaces the n least significant bits of x by the binary value of y."""
+    """Replaces the n least significant bits of x by the binary value of y.
+
+    x and y can be integers or numpy arrays, arrays being replaced sample-wise.
+    """
 
     # Make sure the output value will not exceed the max bits of the pixel
-    if y < 0 or y >= 2**n:
-        print(f"A wrong value was passed to function writeBin ({y}).")
+    mask = (1 << n) - 1
+    if np.any((np.asarray(y) < 0) | (np.asarray(y) > mask)):
+        print(f"A wrong value was passed to function setLSB ({y}).")
         exit(1)
 
-    # Get the two halves of the output value
-    x_bin = bin(x)[2:-n]
-    y_bin = ("{:0" + str(n) + "d}").format(int(bin(y)[2:]))
-    
-    # Merge the two results and convert them to base 10
-    result = int(x_bin + y_bin, 2)
+    # Keep the mask in the type of the array or numpy scalar so that it is
+    # not promoted
+    if isinstance(x, (np.ndarray, np.generic)):
+        mask = x.dtype.type(mask)
+        y = np.asarray(y, dtype=x.dtype)
+
+    # Clear the n least significant bits of x and merge them with y
+    return (x & ~mask) | y
+
+def writeBits(image, bits, lsb, channels, offset = 0, workers = 1, key = None, progress = None):
+    """Writes bits in place on the samples of an image, returns the count written.
+
+    Arrays are written by chunks on workers threads, tiled images on one. The
+    samples are scattered by the key, if any. The progress callback is called
+    after every chunk (see runChunks).
+    """
+
+    # Left-pad the last symbol so that it is written right-aligned
+    pad = -len(bits) % lsb
+    if pad:
+        bits = np.concatenate((bits[:len(bits) - len(bits) % lsb],
+                               np.zeros(pad, dtype=np.uint8),
+                               bits[len(bits) - len(bits) % lsb:]))
+
+    # Group the bits in lsb-bit symbols
+    weights = (1 << np.arange(lsb - 1, -1, -1)).astype(np.uint8)
+    symbols = bits.reshape(-1, lsb) @ weights if len(bits) else bits
+
+    symbols = symbols.astype(np.uint8)
+    count = min(len(symbols), getCapacity(image.shape, channels, offset))
+
+    def writeChunk(start, stop):
+        # Flat indices of the samples to write to, in row-major and R,G,B order
+        indices = getIndices(image.shape, stop - start, channels, offset, start, key)
+
+        # Writing pass over the flattened image
+        values = image.take(indices)
+        written = setLSB(values, symbols[start:stop], lsb)
+        if isinstance(image, np.ndarray):
+            image.put(indices, written)
+            return
+
+        # Only write the changed samples of tiled images, leaving the rest of
+        # their file untouched
+        changed = np.flatnonzero(written != values)
+        image.put(indices[changed], written[changed])
+
+    runChunks(writeChunk, count, workers if isinstance(image, np.ndarray) else 1, progress = progress)
 
-    return result
+    return min(count * lsb, len(bits) - pad)
+
+def writeSyndromes(image, bits, k, channels, offset = 0, workers = 1, key = None, progress = None):
+    """Writes bits in place on the least significant bits of an image by matrix
+    embedding, returns the count written.
+
+    Every k bits are written as the syndrome of the Hamming code of a block of
+    2**k - 1 samples, changing at most one of them: sample j of a block has
+    the parity check column j + 1, and the syndrome is the xor of the columns
+    of the samples whose least significant bit is set.
+    """
+
+    size = (1 << k) - 1
+    columns = np.arange(1, size + 1, dtype=np.uint8)
+
+    # Group the bits in k-bit symbols, right-padded
+    bits = np.concatenate((bits, np.zeros(-len(bits) % k, dtype=np.uint8)))
+    weights = (1 << np.arange(k - 1, -1, -1)).astype(np.uint8)
+    symbols = (bits.reshape(-1, k) @ weights).astype(np.uint8) if len(bits) else bits
+
+    count = min(len(symbols), getCapacity(image.shape, channels, offset) // size)
+
+    def writeChunk(start, stop):
+        # Flat indices of the blocks of samples
+        indices = getIndices(image.shape, (stop - start) * size, channels, offset, start * size, key)
+        values = image.take(indices).reshape(-1, size)
+
+        # Sample to flip in every block whose syndrome differs from its symbol
+        syndromes = np.bitwise_xor.reduce((values & 1) * columns, axis=1)
+        differences = syndromes ^ symbols[start:stop]
+        blocks = np.flatnonzero(differences)
+        changed = blocks * size + differences[blocks] - 1
+
+        # Only write the changed samples
+        image.put(indices[changed], values.reshape(-1)[changed] ^ 1)
+
+    runChunks(writeChunk, count, workers if isinstance(image, np.ndarray) else 1, progress = progress)
+
+    return min(count * k, len(bits))
+
+def embedBits(image, bits, lsb = 1,
+              nored = False, nogreen = False, noblue = False, header = False,
+              flags = 0, workers = 1, key = None, matrix = 0, progress = None):
+    """Writes bits in place on an image, returns the count of bits that do not fit.
+
+    With a matrix code parameter k, the bits are written by matrix embedding
+    on the least significant bit, which needs the header.
+    """
+
+    # Channels to write to
+    channels = getChannels(nored, nogreen, noblue)
+    total = len(bits)
+    if key is not None:
+        flags |= FLAG_SCATTER
+    if matrix:
+        lsb = 1
+        flags |= matrix << MATRIX_SHIFT
+
+    # Write a header describing the payload in front of it
+    offset = 0
+    if header:
+        offset = getOffset(image.shape)
+
+        # Only keep the characters that fit after the header
+        fit = getBits(image.shape, lsb, channels, offset, matrix) // 8
+        data = np.packbits(bits[:fit * 8]).tobytes()
+        headerBits = np.unpackbits(np.frombuffer(
+            packHeader(data, lsb, nored, nogreen, noblue, flags), dtype=np.uint8))
+        writeBits(image, headerBits, 1, CHANNELS)
+
+        # Right-pad the payload to whole symbols
+        bits = bits[:fit * 8]
+        bits = np.concatenate((bits, np.zeros(-len(bits) % lsb, dtype=np.uint8)))
+
+    if matrix:
+        written = writeSyndromes(image, bits, matrix, channels, offset, workers, key, progress)
+    else:
+        written = writeBits(image, bits, lsb, channels, offset, workers, key, progress)
+
+    return max(total - written, 0)
 
 def writeMessage(image, message, lsb = 1,
-                nored = False, nogreen = False, noblue = False):
+                nored = False, nogreen = False, noblue = False, header = False,
+                inplace = False, flags = 0, workers = 1, key = None, matrix = 0, progress = None):
     """Writes text to an image as a combination of least significant bits."""
-    
-    # Get array dimensions to differentiate between RGB and grayscale
-    try:
-        height, width, depth = image.shape
-        gray = False
-    except ValueError:
-        height, width = image.shape
-        depth = 0
-        gray = True
 
     # Function output
-    imgOut = np.copy(image)
+    imgOut = image if inplace else np.copy(image)
 
-    # Channels to write to
-    channels = []
-    if not nored:
-        channels.append(0)
-    if not nogreen:
-        channels.append(1)
-    if not noblue:
-        channels.append(2)
-
-    # Writing loop
-    row, col = 0, 0
-    while row < height:
-        col = 0
-        while col < width:
-            # Grayscale computations
-            if gray:
-                if len(message):
-                    imgOut[row,col] = setLSB(imgOut[row,col], int(message[:lsb], 2), lsb)
-                    message = message[lsb:]
-                    col += 1
-                    continue
-                break
-            
-            # RGB computations
-            else:
-                for ch in channels:
-                    if len(message):
-                        imgOut[row,col,ch] = setLSB(imgOut[row,col,ch], int(message[:lsb], 2), lsb)
-                        message = message[lsb:]
-                        continue
-                    break
-            col += 1
-        row += 1
-    
-    if len(message):
+    # Message bits as an array of 0 and 1
+    if isinstance(message, str):
+        message = np.frombuffer(message.encode("ascii"), dtype=np.uint8) - ord("0")
+    bits = np.asarray(message, dtype=np.uint8)
+
+    if header and getOffset(image.shape) > image.shape[0] * image.shape[1]:
+        print("The image is too small to hold the header of the message.")
+
+    missing = embedBits(imgOut, bits, lsb, nored, nogreen, noblue, header, flags, workers, key, matrix, progress)
+
+    # Bits that did not fit in the image
+    if missing:
         print(f"The message does not fit into the image.")
-        print(f"{int(np.floor(len(message)/8))} characters are missing.")
+        print(f"{int(np.floor(missing/8))} characters are missing.")
     else:
         print("The characters were successfully written to the image.")
 
     return imgOut
 
-def saveImg(image, title = "./output.png", gray = False):
-    """Saves a numpy array to a .png file."""
+def getParams(filePath):
+    """Returns the metadata and encoder parameters of an image file, to save
+    the result with."""
+
+    with Image.open(filePath) as img:
+        info, format = dict(img.info), img.format
+
+    params = {key: info[key] for key in ("dpi", "icc_profile", "exif") if key in info}
+
+    # Text chunks of .png files, and compression of .tiff files (lossy ones
+    # such as jpeg would destroy the message, the result is then left raw)
+    text = {key: value for key, value in info.items() if isinstance(value, str) and key != "compression"}
+    if text:
+        params["text"] = text
+    if format == "TIFF" and "compression" in info:
+        params["compression"] = info["compression"] if info["compression"] in TIFF_COMPRESSIONS else "raw"
+
+    return params
+
+def saveImg(image, title = "./output.png", gray = False,
+            level = None, compression = None, params = None):
+    """Saves a numpy array to an image file, or to a .png binary buffer,
+    returns the encoding time in seconds.
+
+    level is the zlib level of .png files (0 is the fastest, 6 by default),
+    compression the one of .tiff files (raw, packbits, tiff_lzw,
+    tiff_adobe_deflate), and params the metadata given by getParams.
+    """
 
     # Make a PIL image from the numpy array
     img = Image.fromarray(image)
@@ -159,11 +346,272 @@ def saveImg(image, title = "./output.png", gray = False):
     if gray:
         img = img.convert("L")
 
+    # Buffers have no extension to get the format from
+    if isinstance(title, str):
+        format = Image.registered_extensions().get(os.path.splitext(title)[1].lower())
+    else:
+        format = "PNG"
+
+    # Only pass the options of the output format (.bmp files are always raw)
+    options = {key: value for key, value in (params or {}).items() if key in ("dpi", "icc_profile", "exif")}
+    if format == "PNG":
+        if level is not None:
+            options["compress_level"] = level
+        if params and "text" in params:
+            options["pnginfo"] = PngImagePlugin.PngInfo()
+            for key, value in params["text"].items():
+                options["pnginfo"].add_text(key, value)
+    if format == "TIFF":
+        compression = compression or (params or {}).get("compression")
+        options["compression"] = compression if compression in TIFF_COMPRESSIONS else "raw"
+
     # Saving the image
-    img.save(title)
-    print(f"The result is saved as {title}.")
+    start = time.perf_counter()
+    img.save(title, format=format, **options)
+    seconds = time.perf_counter() - start
+
+    if isinstance(title, str):
+        print(f"The result is saved as {title} (encoded in {seconds:.3f}s).")
+
+    return seconds
+
+def printParams(lsb, nored, nogreen, noblue, gray):
+    """Displays the parameters the message is written with."""
+
+    print(f"The message will be written using the{f' {lsb}' if lsb > 1 else ''} least significant bit{'s' if lsb > 1 else ''} of each pixel.")
+    if not gray:
+        print(f"The message will be encrypted using the {'' if nored else 'R'}{'' if nogreen else 'G'}{'' if noblue else 'B'} color channels of each pixel.")
+
+def printPlans(plans):
+    """Displays the capacity and predicted distortion of every lsb."""
+
+    print("Predicted capacity (all channels) and distortion of the message:")
+    for lsb in range(1, 9):
+        plan = max((plan for plan in plans if plan["lsb"] == lsb), key=lambda plan: plan["capacity"])
+        print(f"    -n {lsb}: {plan['capacity']} characters, MSE {plan['mse']:.4f}, PSNR {plan['psnr']:.2f} dB")
+
+def getBits(shape, lsb, channels, offset = 0, matrix = 0):
+    """Returns the number of bits that can be written after the offset pixel."""
+
+    samples = getCapacity(shape, channels, offset)
+    if matrix:
+        return samples // ((1 << matrix) - 1) * matrix
+
+    return samples * lsb
+
+def getLimit(shape, lsb = 1, nored = False, nogreen = False, noblue = False,
+             header = True, matrix = 0):
+    """Returns the number of characters that can be written to an image."""
+
+    offset = getOffset(shape) if header else 0
+    bits = getBits(shape, lsb, getChannels(nored, nogreen, noblue), offset, matrix)
+
+    return int(np.floor(bits/8))
+
+def compressMessage(message, limit, compression = None, level = None, correction = False):
+    """Compresses a message and protects it with error correcting codes if
+    needed, returns it with its header flags.
+
+    Compressed or protected messages must fit whole: the program exits if they
+    do not.
+    """
+
+    flags = FLAG_BINARY if isinstance(message, bytes) else 0
+    data, compressed = compress(toBytes(message), compression, level)
+    if compressed:
+        print(f"The message is compressed from {len(message)} to {len(data)} bytes.")
+    flags |= compressed
+    if correction:
+        data = fec.encode(data)
+        flags |= FLAG_FEC
+    if len(data) > limit:
+        print(f"The {'protected' if correction else 'compressed'} message does not fit into the image ({len(data)} > {limit} bytes). Exiting...")
+        exit(1)
+
+    return data, flags
+
+def checkOutput(outputFile):
+    """Exits if an output file would not be saved in a lossless format
+    (buffers are saved as .png)."""
+
+    if isinstance(outputFile, str) and not outputFile.lower().endswith(OUTPUT_FORMATS):
+        print(f"The format of the output file is not supported. ({outputFile})")
+        print("Please use .png, .tiff, .bmp files as output.")
+        exit(1)
+
+def writeFile(inputFile, outputFile, message, lsb = 1,
+              nored = False, nogreen = False, noblue = False,
+              gray = False, header = True, tile = 0,
+              compression = None, level = None, workers = 1, key = None,
+              correction = False, matrix = 0, pngLevel = None,
+              tiffCompression = None, keepMeta = False, stats = None, progress = None,
+              plan = False, psnr = None, mse = None, quality = None, timer = None):
+    """Hides a message (text or bytes) in an image file, returns the number of characters written.
+
+    The message can also be a function returning it from the number of
+    characters that fit. With plan, the lsb and channels writing it with the
+    lowest predicted distortion within the psnr and mse budgets are used. The
+    quality function, if any, is called with the original and written arrays
+    of images that are not tiled.
+
+    The stages are timed by the timer (a new Stats by default), whose record
+    and the time spent encoding the result are stored in the stats dict, if
+    any. The progress callback is called while the message is written (see
+    runChunks).
+    """
+
+    timer = timer or Stats()
+    checkOutput(outputFile)
+
+    # Get image
+    with timer.stage("decode"):
+        if tile:
+            img = TiledImage.copy(inputFile, outputFile, tile, gray)
+        else:
+            img, px = getImage(inputFile, gray)
+
+    # Characters that fit after the header, if any (with the largest capacity
+    # when the parameters are planned), halved by error correcting codes
+    if plan:
+        nchars = getLimit(img.shape, 8, header = header)
+    else:
+        nchars = getLimit(img.shape, lsb, nored, nogreen, noblue, header, matrix)
+    limit = nchars // 2 if correction else nchars
+
+    # Get the message, and crop it to the capacity of the image unless it is
+    # compressed
+    if callable(message):
+        message = message(limit)
+    if len(message) > limit and not compression:
+        print(f"The message is cropped to the {limit} characters that fit into the image.")
+        print("Use shard.py to split larger messages over several images.")
+        message = message[:limit]
+
+    # Compress the message, and protect it
+    with timer.stage("message"):
+        data, flags = compressMessage(message, nchars, compression, level, correction)
+
+    # Choose the parameters with the lowest predicted distortion
+    if plan:
+        plans = getPlans(img.shape, len(data), header)
+        printPlans(plans)
+        chosen = choosePlan(plans, len(data), psnr, mse)
+        if chosen is None:
+            print("No combination of -n and channels holds the message within the distortion budget. Exiting...")
+            exit(1)
+        lsb, nored, nogreen, noblue = chosen["lsb"], chosen["nored"], chosen["nogreen"], chosen["noblue"]
+        print(f"The plan predicts a MSE of {chosen['mse']:.4f} (PSNR {chosen['psnr']:.2f} dB).")
+        printParams(lsb, nored, nogreen, noblue, gray)
+
+    # Write the message
+    with timer.stage("embed"):
+        imgOut = writeMessage(img, toBinary(data), lsb,
+                              nored = nored, nogreen = nogreen, noblue = noblue,
+                              header = header, inplace = bool(tile), flags = flags,
+                              workers = workers, key = key, matrix = matrix, progress = progress)
+
+    # Compare the images, unless the tiled image was written in place
+    if quality and not tile:
+        with timer.stage("quality"):
+            quality(img, imgOut)
+
+    # Save the result
+    with timer.stage("encode"):
+        if tile:
+            img.save(outputFile)
+            if isinstance(outputFile, str):
+                print(f"The result is saved as {outputFile}.")
+        else:
+            # Reuse the metadata of the input image
+            params = None
+            if keepMeta:
+                if not isinstance(inputFile, str):
+                    inputFile.seek(0)
+                params = getParams(inputFile)
+            seconds = saveImg(imgOut, outputFile, gray, pngLevel, tiffCompression, params)
+
+    if stats is not None:
+        stats.update(timer.record())
+        if not tile:
+            stats["encode_seconds"] = seconds
+
+    return len(message)
+
+def updateFile(filePath, message, tile = 256, key = None, level = None, stats = None):
+    """Replaces the message hidden in an uncompressed .bmp/.tiff file in place,
+    returns the number of characters written.
+
+    The message is written with the parameters of the header already in the
+    file (bits, channels, compression, error correcting codes, matrix code).
+    The pixel data is memory-mapped and only the samples whose bits change are
+    written, the rest of the file being left untouched. The time spent in
+    every stage and the number of samples written are stored in the stats
+    dict, if any.
+    """
+
+    timer = Stats()
+
+    # Map the pixel data of the file
+    with timer.stage("decode"):
+        img = TiledImage(filePath, tile, "r+")
+        if img.tiles is None:
+            print("Only uncompressed .bmp/.tiff files can be updated in place. Exiting...")
+            exit(1)
+        header = readHeader(img)
+        if not header:
+            print("The image holds no header to update. Exiting...")
+            exit(1)
+
+    # Check the key against the message already written, as a wrong key would
+    # scatter the new one over other samples
+    flags = header["flags"]
+    if not flags & FLAG_SCATTER:
+        key = None
+    elif key is None or readPayload(img, header, key = key) is None:
+        print("The message of the image is scattered, the -key it was written with is needed. Exiting...")
+        exit(1)
+
+    # Compress and protect the message as the previous one
+    with timer.stage("message"):
+        lsb, nored, nogreen, noblue = header["lsb"], header["nored"], header["nogreen"], header["noblue"]
+        compression = COMPRESSIONS[(flags & COMPRESSION_MASK) >> COMPRESSION_SHIFT]
+        correction = bool(flags & FLAG_FEC)
+        matrix = (flags & MATRIX_MASK) >> MATRIX_SHIFT
+        limit = getLimit(img.shape, lsb, nored, nogreen, noblue, True, matrix)
+        if not compression:
+            message = message[:limit // 2 if correction else limit]
+        data, flags = compressMessage(message, limit, compression, level, correction)
+
+    # Write the changed samples only
+    with timer.stage("embed"):
+        writeMessage(img, toBinary(data), lsb, nored = nored, nogreen = nogreen, noblue = noblue,
+                     header = True, inplace = True, flags = flags, key = key, matrix = matrix)
+
+    with timer.stage("encode"):
+        img.save(filePath)
+
+    if stats is not None:
+        stats.update(timer.record())
+        stats["samples_written"] = img.written
+
+    return len(message)
+
+def writeBytes(data, message, lsb = 1,
+               nored = False, nogreen = False, noblue = False,
+               gray = False, header = True, compression = None, level = None):
+    """Hides a message in encoded image bytes, returns the .png encoded result."""
+
+    output = io.BytesIO()
+    writeFile(io.BytesIO(data), output, message, lsb, nored, nogreen, noblue, gray, header,
+              compression = compression, level = level)
+
+    return output.getvalue()
 
 if __name__ == "__main__":
+    # Keep the standard output for the image when it is written there
+    if sys.argv[2:3] == ["-"]:
+        sys.stdout = sys.stderr
+
     print("")
 
     # Get arguments
@@ -174,8 +622,13 @@ if __name__ == "__main__":
         printDoc()
     
     # Flags
-    gray, nored, nogreen, noblue, fromfile = False, False, False, False, False
-    lsb = 1
+    gray, nored, nogreen, noblue, fromfile, raw = False, False, False, False, False, False
+    lsb, tile, workers = 1, 0, 1
+    compression, level = None, None
+    plan, psnr, mse = False, None, None
+    key, correction, matrix = None, False, 0
+    pngLevel, tiffCompression, keepMeta = None, None, False
+    statsTarget, profilePath = None, None
 
     # Update flags
     if len(args) > 1:
@@ -187,13 +640,99 @@ if __name__ == "__main__":
             nogreen = True
         if "-noblue" in args:
             noblue = True
+        if "-raw" in args:
+            raw = True
+        if "-plan" in args:
+            plan = True
+        if "-matrix" in args:
+            try:
+                matrix = int(args[args.index("-matrix") + 1])
+            except (IndexError, ValueError):
+                print("The -matrix flag needs to be followed by an integer value.\n")
+                exit(1)
+            if matrix < 1 or matrix > 7 or raw or "-n" in args or "-plan" in args:
+                print("The -matrix code parameter must be between 1 and 7, and cannot be used with -raw, -n or -plan.\n")
+                exit(1)
+        if "-keepmeta" in args:
+            keepMeta = True
+        try:
+            if "-stats" in args:
+                statsTarget = args[args.index("-stats") + 1]
+            if "-profile" in args:
+                profilePath = args[args.index("-profile") + 1]
+        except IndexError:
+            print("The -stats and -profile flags need to be followed by json or a file path.\n")
+            exit(1)
+        if "-pnglevel" in args:
+            try:
+                pngLevel = int(args[args.index("-pnglevel") + 1])
+            except (IndexError, ValueError):
+                print("The -pnglevel flag needs to be followed by an integer value.\n")
+                exit(1)
+            if pngLevel < 0 or pngLevel > 9:
+                print("The .png compression level must be between 0 and 9.")
+                exit(1)
+        if "-tiffcompression" in args:
+            tiffCompression = args[args.index("-tiffcompression") + 1] if args.index("-tiffcompression") + 1 < len(args) else ""
+            if tiffCompression not in TIFF_COMPRESSIONS:
+                print("The -tiffcompression flag needs to be followed by raw, packbits, tiff_lzw or tiff_adobe_deflate.\n")
+                exit(1)
+        if "-fec" in args:
+            correction = True
+            if raw:
+                print("Protected messages need the header, they cannot be written with -raw.\n")
+                exit(1)
+        if "-key" in args:
+            if args.index("-key") + 1 >= len(args):
+                print("The -key flag needs to be followed by a text key.\n")
+                exit(1)
+            key = args[args.index("-key") + 1]
+        try:
+            if "-psnr" in args:
+                psnr = float(args[args.index("-psnr") + 1])
+            if "-mse" in args:
+                mse = float(args[args.index("-mse") + 1])
+        except (IndexError, ValueError):
+            print("The -psnr and -mse flags need to be followed by a number.\n")
+            exit(1)
         if "-fromfile" in args:
             try:
-                message = open(args[args.index("-fromfile") + 1],'r').read()
+                textFile = args[args.index("-fromfile") + 1]
+                message = sys.stdin.buffer.read() if textFile == "-" else open(textFile,'rb').read()
                 fromfile = True
-            except FileNotFoundError:
+            except (FileNotFoundError, IndexError):
                 print("The -fromfile flag needs to be followed by a valid text file path.\n")
                 exit(1)
+        if "-tile" in args:
+            try:
+                tile = int(args[args.index("-tile") + 1])
+            except (IndexError, ValueError):
+                print("The -tile flag needs to be followed by an integer value.\n")
+                exit(1)
+        if "-j" in args:
+            try:
+                workers = int(args[args.index("-j") + 1])
+            except (IndexError, ValueError):
+                print("The -j flag needs to be followed by an integer value.\n")
+                exit(1)
+        if "-compress" in args:
+            compression = args[args.index("-compress") + 1] if args.index("-compress") + 1 < len(args) else ""
+            if compression not in COMPRESSIONS[1:]:
+                print("The -compress flag needs to be followed by zlib, bz2 or lzma.\n")
+                exit(1)
+            if raw:
+                print("Compressed messages need the header, they cannot be written with -raw.\n")
+                exit(1)
+        if "-level" in args:
+            try:
+                level = int(args[args.index("-level") + 1])
+            except (IndexError, ValueError):
+                print("The -level flag needs to be followed by an integer value.\n")
+                exit(1)
+            low, high = LEVELS.get(compression, (0, 9))
+            if level < low or level > high:
+                print(f"The compression level must be between {low} and {high}.")
+                exit(1)
         if "-n" in args:
             try:
                 lsb = int(args[args.index("-n") + 1])
@@ -205,52 +744,71 @@ if __name__ == "__main__":
                 print("The amount of least significant bytes to write on must be between 1 and 8.")
                 exit(1)
     
+    # Replace the message of a file in place, with the parameters it was written with
+    if "-update" in args:
+        if not fromfile:
+            print("The -update flag needs the new message to be read from a file with -fromfile.")
+            exit(1)
+        timer = Stats(profile = profilePath)
+        stats = {}
+        nchars = updateFile(args[0], message, tile or 256, key, level, stats)
+        print(f"{nchars} characters were written by patching {stats['samples_written']} samples of {args[0]} in place.")
+        timer.close()
+        if statsTarget:
+            saveStats(stats, statsTarget)
+        exit(0)
+
     # User information
-    print(f"The message will be written using the{f' {lsb}' if lsb > 1 else ''} least significant bit{'s' if lsb > 1 else ''} of each pixel.")
-    if not gray:
-        print(f"The message will be encrypted using the {'' if nored else 'R'}{'' if nogreen else 'G'}{'' if noblue else 'B'} color channels of each pixel.")
+    if not plan:
+        printParams(lsb, nored, nogreen, noblue, gray)
+    if matrix:
+        print(f"The message will be written by matrix embedding, {matrix} bits on every block of {(1 << matrix) - 1} samples.")
 
     # Get the input/output files
     inputFormats = (".jpg", ".png", ".jpeg", ".tiff", ".bmp")
-    outputFormats = (".png", ".tiff", ".bmp")
     inputFile = args[0]
     outputFile = args[1]
 
-    if not len([x for x in inputFormats if x in inputFile]):
+    if inputFile != "-" and not len([x for x in inputFormats if x in inputFile]):
         print(f"The format of the input file is not supported. ({inputFile})")
         print("Please use .jpg, .png, .jpeg, .tiff, .bmp files as input.")
         exit(1)
-
-    if not len([x for x in outputFormats if x in outputFile]):
-        print(f"The format of the output file is not supported. ({outputFile})")
-        print("Please use .png, .tiff, .bmp files as output.")
-        exit(1)
-
-    # Get image
-    img, px = getImage(inputFile, gray)
-    
-    # Get total writable characters count
-    multiplier = (3 - (int(nored) + int(nogreen) + int(noblue)))**int(1-gray)
-    bits = px*multiplier
-    nchars = int(np.floor(bits*lsb/8))
-    
-    # Get the user message
+    if outputFile != "-":
+        checkOutput(outputFile)
+
+    # Use the standard input and output as binary buffers
+    if inputFile == "-":
+        if not fromfile or textFile == "-":
+            print("The message must be read from a file when the image is read from the standard input.")
+            exit(1)
+        inputFile = io.BytesIO(sys.stdin.buffer.read())
+    if outputFile == "-":
+        outputFile = sys.__stdout__.buffer
+
+    # Get the user message once the capacity of the image is known
     if fromfile:
-        print("The message to write is read from an external text file.")
-        if len(message) > nchars:
-            message = message[:nchars] # Crop to max length
+        print("The message to write is read from an external file.")
     else:
-        message = getMessage(nchars)
-    binMessage = toBinary(message)
+        message = getMessage
 
-    # Write the message to a new image
-    imgOut = writeMessage(img, binMessage, lsb,
-                         nored = nored, nogreen = nogreen, noblue = noblue)
-    
-    # Compute the distance between the two images
-    dist = np.linalg.norm(imgOut - img)
-    print(f"The distance between the two images is {dist:.2f}.")
+    def report(img, imgOut):
+        """Displays the distance between the two images."""
 
-    # Save the result
+        error = getMSE(imgOut, img)
+        print(f"The distance between the two images is {np.sqrt(error * img.size):.2f}.")
+        print(f"The MSE is {error:.4f} (PSNR {toPSNR(error):.2f} dB).")
+
+        # The structural similarity needs float copies of the whole images
+        if "-ssim" in args:
+            print(f"The SSIM is {getSSIM(imgOut, img):.6f}.")
+
+    # Write the message to a new image, timing every stage
+    timer = Stats("-tracemalloc" in args, profilePath)
+    writeFile(inputFile, outputFile, message, lsb, nored, nogreen, noblue, gray, not raw, tile,
+              compression, level, workers, key, correction, matrix, pngLevel, tiffCompression,
+              keepMeta, plan = plan, psnr = psnr, mse = mse, quality = report, timer = timer)
     print("All computations were performed successfully.")
-    saveImg(imgOut, outputFile, gray)
+
+    timer.close()
+    if statsTarget:
+        saveStats(timer.record(), statsTarget)